@@ -0,0 +1,193 @@
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic_docx import generate_corpus
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on a synthetic corpus with a local API stand-in.")
+    parser.add_argument("--docs", type=int, default=50, help="Number of synthetic documents")
+    parser.add_argument("--paragraphs", type=int, default=50, help="Paragraphs per document")
+    parser.add_argument("--tables", type=int, default=2, help="Tables per document")
+    parser.add_argument("--images", type=int, default=2, help="Unique images per document (plus a shared logo)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Simulated latency per API request")
+    parser.add_argument("--workers", type=int, default=1, help="--workers value for the end-to-end stage")
+    parser.add_argument("--assets", action="store_true", help="Use the attachments image store instead of base64")
+    parser.add_argument("--json", help="Also write the report as JSON to this path")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own progress output")
+    return parser.parse_args()
+
+def configure(work_dir, latency_ms):
+    """Point every store at work_dir and select the offline provider, before any module import."""
+    try:
+        import config
+    except ImportError:
+        config = types.ModuleType("config")
+        sys.modules["config"] = config
+
+    config.LLM_PROVIDER = "local"
+    config.LOCAL_PROVIDER_LATENCY_MS = latency_ms
+    config.CHROMA_PATH = os.path.join(work_dir, "chroma_data")
+    config.EMBED_CACHE_PATH = os.path.join(work_dir, "embedding_cache.sqlite")
+    config.LLM_CACHE_PATH = os.path.join(work_dir, "llm_cache.sqlite")
+    config.MANIFEST_PATH = os.path.join(work_dir, "manifest.json")
+    config.DOC_VECTOR_PATH = os.path.join(work_dir, "doc_vectors")
+    config.LINK_STATE_PATH = os.path.join(work_dir, "link_state.json")
+    config.DEDUP_INDEX_PATH = os.path.join(work_dir, "dedup_index.json")
+
+def peak_rss_mb():
+    """Peak resident memory of this process and its finished children, in MB."""
+    if resource is None:
+        return None
+    usage = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return usage / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+class StageRecorder:
+    """Collects wall time, throughput and peak memory for each benchmark stage."""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name, docs):
+        info = {"stage": name, "docs": docs, "tokens": 0}
+        start = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            if not self.verbose:
+                devnull = stack.enter_context(open(os.devnull, "w"))
+                stack.enter_context(contextlib.redirect_stdout(devnull))
+            yield info
+        info["seconds"] = time.perf_counter() - start
+        info["peak_rss_mb"] = peak_rss_mb()
+        self.stages.append(info)
+
+    def finalize(self):
+        """Compute rates; token counts may be filled in after a stage ends (outside its timing)."""
+        for info in self.stages:
+            seconds = info["seconds"]
+            info["docs_per_sec"] = info["docs"] / seconds if seconds else None
+            info["tokens_per_sec"] = info["tokens"] / seconds if seconds and info["tokens"] else None
+        return self.stages
+
+    def print_report(self, wall_time):
+        print(f"\n{'stage':<14}{'docs':>7}{'seconds':>10}{'docs/s':>10}{'tokens/s':>12}{'peak MB':>10}")
+        for info in self.finalize():
+            tokens_per_sec = f"{info['tokens_per_sec']:.0f}" if info["tokens_per_sec"] else "-"
+            peak = f"{info['peak_rss_mb']:.0f}" if info["peak_rss_mb"] is not None else "-"
+            print(
+                f"{info['stage']:<14}{info['docs']:>7}{info['seconds']:>10.2f}"
+                f"{info['docs_per_sec'] or 0:>10.1f}{tokens_per_sec:>12}{peak:>10}"
+            )
+        print(f"\nTotal wall time: {wall_time:.2f}s")
+
+def run(args, work_dir):
+    configure(work_dir, args.latency_ms)
+
+    # Imported only after configure() so every module picks up the benchmark settings
+    import main
+    from modules.backlinker import compute_link_state, build_link_graph, write_link_graph
+    from modules.chunking import get_tokenizer
+    from modules.docx_extractor import extract_text_and_images
+    from modules.embedding_manager import store_documents_in_chroma, strip_embedded_images, get_embedding_cache
+    from modules.metrics import metrics
+    from modules.obsidian_generator import convert_to_lyt_markdown
+
+    input_dir = os.path.join(work_dir, "input_docs")
+    md_dir = os.path.join(work_dir, "markdown")
+    asset_dir = os.path.join(md_dir, "attachments") if args.assets else None
+    os.makedirs(md_dir, exist_ok=True)
+
+    paths = generate_corpus(input_dir, args.docs, args.paragraphs, args.tables, args.images)
+    recorder = StageRecorder(verbose=args.verbose)
+    wall_start = time.perf_counter()
+
+    with recorder.stage("extract", len(paths)) as info:
+        extracted = {}
+        for path in paths:
+            title = os.path.splitext(os.path.basename(path))[0]
+            extracted[title] = extract_text_and_images(path, asset_dir=asset_dir)[0]
+    tokenizer = get_tokenizer()
+    text_tokens = sum(len(tokenizer.encode(strip_embedded_images(text))) for text in extracted.values())
+    info["tokens"] = text_tokens
+
+    with recorder.stage("convert", len(extracted)) as info:
+        documents = []
+        for title, text in extracted.items():
+            md_content = convert_to_lyt_markdown(text, title, use_cache=False)
+            with open(os.path.join(md_dir, f"{title}.md"), "w", encoding="utf-8") as f:
+                f.write(md_content)
+            documents.append({"doc_id": title, "text": md_content, "metadata": {"title": title, "source": f"{title}.docx"}})
+    info["tokens"] = text_tokens
+
+    with recorder.stage("embed+store", len(documents)) as info:
+        for start in range(0, len(documents), main.EMBED_FLUSH_DOCS):
+            store_documents_in_chroma(documents[start:start + main.EMBED_FLUSH_DOCS])
+    info["tokens"] = sum(len(tokenizer.encode(strip_embedded_images(doc["text"]))) for doc in documents)
+
+    with recorder.stage("backlink", len(documents)) as info:
+        # Full computation, as main.py does when there are no links from a previous run
+        link_state, _ = compute_link_state(None, threshold=0.25, top_k=10)
+        link_graph = build_link_graph({title: [linked for linked, _ in hits] for title, hits in link_state["links"].items()})
+        write_link_graph(link_graph, md_dir, sorted(extracted))
+
+    # End-to-end pass 1 through main.py with cold caches
+    get_embedding_cache().clear()
+    main.INPUT_DIR = input_dir
+    main.OUTPUT_MD_DIR = os.path.join(work_dir, "markdown_e2e")
+    os.makedirs(main.OUTPUT_MD_DIR, exist_ok=True)
+    files = [(os.path.basename(path), f"benchmark-{i}") for i, path in enumerate(paths)]
+    with recorder.stage("main pass 1", len(files)) as info:
+        main.run_conversion_pass(
+            files, manifest={}, workers=args.workers,
+            asset_dir=os.path.join(main.OUTPUT_MD_DIR, "attachments") if args.assets else None,
+            use_llm_cache=False
+        )
+    info["tokens"] = text_tokens
+
+    wall_time = time.perf_counter() - wall_start
+    recorder.print_report(wall_time)
+
+    if args.json:
+        report = {
+            "settings": vars(args),
+            "wall_seconds": wall_time,
+            "stages": recorder.finalize(),
+            "metrics": metrics.snapshot(),
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+
+def main():
+    args = parse_args()
+    work_dir = tempfile.mkdtemp(prefix="kb_benchmark_")
+    try:
+        run(args, work_dir)
+    finally:
+        if args.keep:
+            print(f"Working directory kept at {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
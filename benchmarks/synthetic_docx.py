@@ -0,0 +1,156 @@
+import os
+import random
+import struct
+import zipfile
+import zlib
+from xml.sax.saxutils import escape
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+WORDS = (
+    "deployment pipeline service cluster release incident runbook database "
+    "migration schema backup restore latency throughput monitoring alert "
+    "dashboard owner team onboarding access token secret rotation policy "
+    "network firewall gateway endpoint api client server cache queue worker "
+    "storage bucket retention audit compliance review approval rollback "
+    "configuration environment staging production feature flag experiment"
+).split()
+
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Default Extension="png" ContentType="image/png"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+
+PACKAGE_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+def make_png(width, height, rng):
+    """Build a valid PNG of random pixels."""
+    raw = b"".join(
+        b"\x00" + bytes(rng.getrandbits(8) for _ in range(width * 3))
+        for _ in range(height)
+    )
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+def sentence(rng, n_words):
+    words = [rng.choice(WORDS) for _ in range(n_words)]
+    return " ".join(words).capitalize() + "."
+
+def paragraph_xml(text, style=None):
+    style_xml = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+    return f'<w:p>{style_xml}<w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+def image_xml(rel_id):
+    return (
+        '<w:p><w:r><w:drawing><wp:inline><a:graphic><a:graphicData>'
+        f'<pic:pic><pic:blipFill><a:blip r:embed="{rel_id}"/></pic:blipFill></pic:pic>'
+        '</a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>'
+    )
+
+def table_xml(rng, rows, cols):
+    xml_rows = []
+    for _ in range(rows):
+        cells = "".join(
+            f"<w:tc>{paragraph_xml(sentence(rng, 3))}</w:tc>" for _ in range(cols)
+        )
+        xml_rows.append(f"<w:tr>{cells}</w:tr>")
+    return f"<w:tbl>{''.join(xml_rows)}</w:tbl>"
+
+def write_synthetic_docx(path, paragraphs=50, tables=2, images=2, seed=0, logo=None):
+    """
+    Write one synthetic Word document.
+
+    Args:
+        path: Output .docx path
+        paragraphs: Number of body paragraphs (a heading is added every 10)
+        tables: Number of 5x4 tables spread through the document
+        images: Number of unique embedded images
+        seed: Random seed (same seed, same document)
+        logo: PNG bytes of an image shared across documents, added at the top
+    """
+    rng = random.Random(seed)
+    body = []
+    media = {}
+    rels = []
+
+    if logo is not None:
+        media["word/media/logo.png"] = logo
+        rels.append(("rIdLogo", "media/logo.png"))
+        body.append(image_xml("rIdLogo"))
+
+    table_every = max(1, paragraphs // (tables + 1)) if tables else None
+    image_every = max(1, paragraphs // (images + 1)) if images else None
+    tables_left, images_left = tables, images
+
+    for i in range(paragraphs):
+        if i % 10 == 0:
+            body.append(paragraph_xml(sentence(rng, 4), style="Heading2"))
+        body.append(paragraph_xml(" ".join(sentence(rng, rng.randint(8, 20)) for _ in range(4))))
+
+        if tables_left and table_every and (i + 1) % table_every == 0:
+            body.append(table_xml(rng, rows=5, cols=4))
+            tables_left -= 1
+        if images_left and image_every and (i + 1) % image_every == 0:
+            name = f"media/image{images - images_left + 1}.png"
+            rel_id = f"rIdImg{images - images_left + 1}"
+            media[f"word/{name}"] = make_png(32, 32, rng)
+            rels.append((rel_id, name))
+            body.append(image_xml(rel_id))
+            images_left -= 1
+
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<w:document xmlns:w="{W_NS}" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+        'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+        'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture" '
+        'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing">'
+        f'<w:body>{"".join(body)}<w:sectPr/></w:body></w:document>'
+    )
+    document_rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        + "".join(
+            f'<Relationship Id="{rel_id}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" Target="{target}"/>'
+            for rel_id, target in rels
+        )
+        + "</Relationships>"
+    )
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as docx_zip:
+        docx_zip.writestr("[Content_Types].xml", CONTENT_TYPES)
+        docx_zip.writestr("_rels/.rels", PACKAGE_RELS)
+        docx_zip.writestr("word/document.xml", document)
+        docx_zip.writestr("word/_rels/document.xml.rels", document_rels)
+        for name, blob in media.items():
+            docx_zip.writestr(name, blob)
+
+def generate_corpus(output_dir, n_docs, paragraphs=50, tables=2, images=2, seed=0):
+    """
+    Write n_docs synthetic documents to output_dir.
+    Documents are written directly as Office Open XML and contain headings,
+    paragraphs, tables and embedded PNG images. One "logo" image is shared
+    by every document, like the branding on exported Confluence pages.
+
+    Returns:
+        List of written file paths
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    logo = make_png(64, 16, random.Random(seed))
+
+    paths = []
+    for i in range(n_docs):
+        path = os.path.join(output_dir, f"synthetic_{i:05d}.docx")
+        write_synthetic_docx(path, paragraphs, tables, images, seed=seed + i + 1, logo=logo)
+        paths.append(path)
+    return paths
@@ -1,107 +1,581 @@
+import argparse
+import contextlib
+import cProfile
+import json
+import multiprocessing
 import os
+import time
+import traceback
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
-from modules.docx_extractor import extract_text_and_images
-from modules.obsidian_generator import convert_to_lyt_markdown
-from modules.embedding_manager import store_in_chroma
-from modules.backlinker import generate_backlinks, update_bidirectional_links
+from modules.docx_extractor import extract_text_and_images, extract_in_worker
+from modules.obsidian_generator import convert_to_lyt_markdown, conversion_settings, get_llm_cache
+from modules.embedding_manager import embed_documents, ChromaWriteBuffer, delete_records, get_embedding_cache, get_document_store
+from modules.backlinker import (
+    compute_link_state, load_link_state, save_link_state, build_link_graph, write_link_graph, strip_backlinks_section
+)
+from modules.dedup import DedupIndex, duplicate_markdown
+from modules.manifest import load_manifest, save_manifest, record_document, is_unchanged, file_sha256, text_sha256
+from modules.metrics import metrics, profiling, save_profile
+from modules.pipeline import Pipeline, Sequencer, Stage
+from modules.providers import get_provider
+from modules.reconcile import reconcile
 
 INPUT_DIR = "data/input_docs"
 OUTPUT_MD_DIR = "output/markdown"
+# Image store used with --assets (images referenced from notes as attachments/<hash>.<ext>)
+ATTACHMENTS_DIR = os.path.join(OUTPUT_MD_DIR, "attachments")
 
-os.makedirs(OUTPUT_MD_DIR, exist_ok=True)
+# Documents are embedded and stored in groups so chunks from several
+# documents share embedding requests
+EMBED_FLUSH_DOCS = 20
 
-# Note: No OUTPUT_IMG_DIR needed - images embedded in markdown!
+# Capacity of each queue between pipeline stages; bounds the documents held in memory
+QUEUE_SIZE = 16
 
-# ---- PASS 1: Convert DOCX → Markdown + Store Embeddings ----
-print("\n Step 1: Converting Word files and storing embeddings...\n")
-print("ℹ  Images will be embedded directly in markdown files (no separate image files)\n")
+# Run report (run_report.json) and Prometheus metrics (metrics.prom) are written here
+METRICS_DIR = "output/metrics"
 
-# Debug: List all files in directory
-all_files = os.listdir(INPUT_DIR)
-print(f" Files found in {INPUT_DIR}:")
-for f in all_files:
-    print(f"   - {f} (ends with .docx: {f.endswith('.docx')})")
-print()
+# Note: By default no image folder is needed - images are embedded in markdown!
 
-processed_count = 0
-for file in tqdm(os.listdir(INPUT_DIR), desc="Processing Word files"):
-    if file.endswith(".docx") or file.endswith(".doc"):
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert Word documents into a linked Obsidian vault.")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Default for --extract-workers and --convert-workers. Default: 1"
+    )
+    parser.add_argument(
+        "--extract-workers", type=int,
+        help="Documents extracted concurrently (more than 1 uses a process pool)"
+    )
+    parser.add_argument(
+        "--convert-workers", type=int,
+        help="Documents converted by the chat model concurrently"
+    )
+    parser.add_argument(
+        "--embed-workers", type=int, default=1,
+        help="Embedding requests in flight at once. Default: 1"
+    )
+    parser.add_argument(
+        "--queue-size", type=int, default=QUEUE_SIZE,
+        help=f"Documents buffered between pipeline stages. Default: {QUEUE_SIZE}"
+    )
+    parser.add_argument(
+        "--assets", action="store_true",
+        help="Store images once in output/markdown/attachments instead of inlining them as base64"
+    )
+    parser.add_argument(
+        "--no-llm-cache", action="store_true",
+        help="Always call the chat model, ignoring cached conversions"
+    )
+    parser.add_argument(
+        "--no-dedup", action="store_true",
+        help="Convert near-duplicate documents separately instead of reusing one conversion"
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="Reprocess every document, even if it is unchanged since the last run"
+    )
+    parser.add_argument(
+        "--gc", action="store_true",
+        help="After conversion, delete ChromaDB records of notes that no longer exist and stale chunks"
+    )
+    parser.add_argument(
+        "--full-relink", action="store_true",
+        help="Recompute every note's links instead of only those affected by changed documents"
+    )
+    parser.add_argument(
+        "--metrics-dir", default=METRICS_DIR,
+        help=f"Where to write the JSON run report and Prometheus metrics file. Default: {METRICS_DIR}"
+    )
+    parser.add_argument(
+        "--profile-doc", metavar="TITLE",
+        help="Profile the processing of one document (file name without extension) with cProfile"
+    )
+    return parser.parse_args()
+
+def list_input_files():
+    """Return the Word files in INPUT_DIR in a stable (sorted) order."""
+    return sorted(f for f in os.listdir(INPUT_DIR) if f.endswith(".docx") or f.endswith(".doc"))
+
+def settings_fingerprint(asset_dir=None):
+    """
+    Hash of the settings that shape a note and its stored embeddings. Documents
+    recorded with a different fingerprint are processed again, e.g. after
+    switching --assets, the chat or embedding model, the prompts or CONVERT_CHUNK_TOKENS.
+    """
+    settings = dict(conversion_settings(), assets=asset_dir is not None, embed_model=get_provider().embed_model)
+    return text_sha256(json.dumps(settings, sort_keys=True))
+
+def read_markdown_body(title):
+    """Return a note's generated body (without Related Notes), or None if it doesn't exist."""
+    md_path = os.path.join(OUTPUT_MD_DIR, f"{title}.md")
+    if not os.path.exists(md_path):
+        return None
+    with open(md_path, "r", encoding="utf-8") as f:
+        return strip_backlinks_section(f.read())
+
+def convert_and_save(file, text, embedded_images, source_hash, use_llm_cache=True):
+    """
+    Convert extracted text to markdown and save it.
+
+    Returns:
+        Document record ready for embed_documents
+    """
+    title = os.path.splitext(file)[0]
+    print(f"    ✓ Extracted {len(text)} characters, {len(embedded_images)} images (embedded)")
+
+    # Convert to markdown with embedded images
+    with metrics.timer("pipeline_stage_seconds", stage="convert"):
+        md_content = convert_to_lyt_markdown(text, title, use_cache=use_llm_cache)
+    print(f"    ✓ Converted to markdown ({len(md_content)} characters)")
+
+    # Save Markdown (contains embedded images!)
+    output_path = os.path.join(OUTPUT_MD_DIR, f"{title}.md")
+    with metrics.timer("pipeline_stage_seconds", stage="write"):
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(md_content)
+    metrics.inc("bytes_written_total", len(md_content.encode("utf-8")), kind="markdown")
+    print(f"    ✓ Saved to {output_path}")
+
+    return {
+        "doc_id": title,
+        "text": md_content,
+        "metadata": {"title": title, "source": file},
+        "source_hash": source_hash,
+        "markdown_hash": text_sha256(md_content)
+    }
+
+def extract_document(file, extract_pool=None, asset_dir=None):
+    """
+    Extract text and images from one document (base64 data URLs, or attachment links with asset_dir).
+    Extraction runs in extract_pool when given, otherwise in the calling thread.
+    """
+    doc_path = os.path.join(INPUT_DIR, file)
+    print(f"\n  Processing: {os.path.splitext(file)[0]}")
+
+    with metrics.timer("pipeline_stage_seconds", stage="extract"):
+        if extract_pool is None:
+            return extract_text_and_images(doc_path, asset_dir=asset_dir)
+        result, worker_metrics = extract_pool.submit(extract_in_worker, doc_path, asset_dir).result()
+        metrics.merge(worker_metrics)
+        return result
+
+def update_manifest(manifest, docs, record_ids):
+    """Record stored documents in the manifest and drop chunks they no longer produce."""
+    stale_ids = []
+    for doc in docs:
+        stale_ids.extend(record_document(
+            manifest,
+            source_file=doc["metadata"]["source"],
+            title=doc["doc_id"],
+            source_hash=doc["source_hash"],
+            markdown_hash=doc["markdown_hash"],
+            chunk_ids=record_ids[doc["doc_id"]],
+            settings=doc.get("settings")
+        ))
+    delete_records(stale_ids)
+    save_manifest(manifest)
+
+def report_failure(stage, file, error):
+    metrics.inc("documents_total", status="failed")
+    print(f"    ✗ ERROR ({stage}) processing {file}: {str(error)}")
+    traceback.print_exception(type(error), error, error.__traceback__)
+
+def embed_pending(docs):
+    """
+    Embed a group of converted documents in shared requests; fall back to one-by-one on failure.
+
+    Returns:
+        List of (docs, (records, record_ids)) groups ready for store_embedded
+    """
+    try:
+        return [(docs, embed_documents(docs))]
+    except Exception as e:
+        print(f"\n    ⚠️  Batch embedding failed ({str(e)}), embedding documents individually")
+
+    groups = []
+    for doc in docs:
         try:
-            doc_path = os.path.join(INPUT_DIR, file)
-            title = os.path.splitext(file)[0]
-            
-            print(f"\n  Processing: {title}")
-
-            # Extract text and images (images as base64 data URLs)
-            text, embedded_images = extract_text_and_images(doc_path)
-            print(f"    ✓ Extracted {len(text)} characters, {len(embedded_images)} images (embedded)")
-            
-            # Convert to markdown with embedded images
-            md_content = convert_to_lyt_markdown(text, title)
-            print(f"    ✓ Converted to markdown ({len(md_content)} characters)")
-
-            # Save Markdown (contains embedded images!)
-            output_path = os.path.join(OUTPUT_MD_DIR, f"{title}.md")
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(md_content)
-            print(f"    ✓ Saved to {output_path}")
-
-            # Store in Chroma (with automatic chunking)
-            store_in_chroma(
-                doc_id=title,
-                text=md_content,
-                metadata={"title": title, "source": file}
-            )
-            print(f"    ✓ Stored embeddings")
-            
-            processed_count += 1
-            
+            groups.append(([doc], embed_documents([doc])))
         except Exception as e:
-            print(f"    ✗ ERROR processing {file}: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            report_failure("embed", doc["metadata"]["source"], e)
+    return groups
+
+def commit_written(flushed, manifest):
+    """
+    Record documents whose records reached ChromaDB in the manifest (saved once)
+    and report the ones that failed.
+
+    Args:
+        flushed: (written, failed) from ChromaWriteBuffer, with (doc, record_ids) items
+
+    Returns:
+        List of stored documents
+    """
+    written, failed = flushed
+    for (doc, _), error in failed:
+        report_failure("store", doc["metadata"]["source"], error)
+    if not written:
+        return []
 
-print("\n Step 1 complete: All Markdown files created and embedded.\n")
-print(f"   Successfully processed: {processed_count} documents\n")
+    docs = [doc for doc, _ in written]
+    update_manifest(manifest, docs, {doc["doc_id"]: record_ids for doc, record_ids in written})
+    print(f"\n    ✓ Stored embeddings for {len(docs)} documents")
+    return docs
 
-# ---- PASS 2: Generate Backlinks (with bidirectional linking) ----
-print(" Step 2: Generating semantic backlinks...\n")
+def store_embedded(group, manifest, write_buffer):
+    """
+    Queue an embedded group for writing to ChromaDB. Documents are only
+    recorded in the manifest once the buffer has written their records.
 
-# Track all backlink relationships for bidirectional updates
-backlink_map = {}  # {source_title: [target_titles]}
+    Returns:
+        List of documents stored by this call (those flushed), or None
+    """
+    docs, (records, record_ids) = group
+    stored = []
+    with metrics.timer("pipeline_stage_seconds", stage="store"):
+        # embed_documents returns each document's records together, in document order
+        offset = 0
+        for doc in docs:
+            doc_ids = record_ids[doc["doc_id"]]
+            flushed = write_buffer.add(records[offset:offset + len(doc_ids)], item=(doc, doc_ids))
+            offset += len(doc_ids)
+            stored.extend(commit_written(flushed, manifest))
+    return stored or None
 
-for file in tqdm(os.listdir(OUTPUT_MD_DIR), desc="Linking Markdown files"):
-    if file.endswith(".md"):
+def select_changed_files(files, manifest, force=False, settings=None):
+    """
+    Split input files into those that need processing and those unchanged since the last run
+    (with the same settings fingerprint).
+    Near-duplicates are processed again whenever their representative is, or when it
+    no longer exists, since their notes reuse its markdown.
+
+    Returns:
+        (list of (file, source_hash) to process, number of skipped files)
+    """
+    to_process = []
+    unchanged = []
+    for file in files:
+        source_hash = file_sha256(os.path.join(INPUT_DIR, file))
         title = os.path.splitext(file)[0]
-        md_path = os.path.join(OUTPUT_MD_DIR, file)
-        
-        with open(md_path, "r", encoding="utf-8") as f:
-            md_content = f.read()
-
-        # Generate backlinks (excluding self-references)
-        backlinks_text = generate_backlinks(md_content, current_title=title, threshold=0.25, top_k=10)
-        
-        # Extract linked titles for bidirectional updating
-        if backlinks_text:
-            linked_titles = []
-            for line in backlinks_text.split('\n'):
-                if line.startswith('- [[') and line.endswith(']]'):
-                    linked_titles.append(line[4:-2])
-            
-            backlink_map[title] = linked_titles
-            
-            # Append backlinks to file
-            with open(md_path, "a", encoding="utf-8") as f:
-                f.write(backlinks_text)
-
-print("\n Step 3: Creating bidirectional links...\n")
-
-# Update all target documents to link back to source
-for source_title, target_titles in tqdm(backlink_map.items(), desc="Updating bidirectional links"):
-    update_bidirectional_links(source_title, target_titles, OUTPUT_MD_DIR)
-
-print("\n All documents processed with semantic bidirectional linking!")
-print(f"\nSummary:")
-print(f"   - Documents processed: {len([f for f in os.listdir(OUTPUT_MD_DIR) if f.endswith('.md')])}")
-print(f"   - Bidirectional link pairs created: {sum(len(v) for v in backlink_map.values())}")
-print(f"\n Note: Images are embedded directly in markdown files")
+        if not force and is_unchanged(manifest, file, source_hash, read_markdown_body(title), settings):
+            unchanged.append((file, source_hash))
+            continue
+        to_process.append((file, source_hash))
+
+    changed_titles = {os.path.splitext(file)[0] for file, _ in to_process}
+    manifest_titles = {entry["title"] for entry in manifest.values()}
+    for file, source_hash in unchanged:
+        representative = manifest[file].get("duplicate_of")
+        # Also rebuild duplicates whose representative is gone (e.g. pruned by --gc)
+        if representative is not None and (representative in changed_titles or representative not in manifest_titles):
+            to_process.append((file, source_hash))
+    # Sorted, so near-duplicates are resolved in the same order on every run
+    return sorted(to_process), len(files) - len(to_process)
+
+def write_duplicates(duplicates, manifest, settings=None):
+    """
+    Write the notes of near-duplicate documents once their representatives
+    are converted, reusing the representative's markdown, and record them
+    in the manifest without any ChromaDB records of their own (so they
+    neither cost embeddings nor crowd the representative's backlinks).
+
+    Args:
+        duplicates: List of jobs with "file", "source_hash", "duplicate_of" and "similarity"
+
+    Returns:
+        Number of duplicate notes written
+    """
+    docs = []
+    for job in duplicates:
+        title = os.path.splitext(job["file"])[0]
+        representative_body = read_markdown_body(job["duplicate_of"])
+        if representative_body is None:
+            report_failure("dedup", job["file"], RuntimeError(f"representative '{job['duplicate_of']}' was not converted"))
+            continue
+
+        md_content = duplicate_markdown(title, job["duplicate_of"], representative_body, job["similarity"])
+        with metrics.timer("pipeline_stage_seconds", stage="write"):
+            with open(os.path.join(OUTPUT_MD_DIR, f"{title}.md"), "w", encoding="utf-8") as f:
+                f.write(md_content)
+        metrics.inc("bytes_written_total", len(md_content.encode("utf-8")), kind="markdown")
+        print(f"    ✓ {title}: near-duplicate of {job['duplicate_of']} ({job['similarity']:.0%}), markdown reused")
+        docs.append((job, title, md_content))
+
+    if not docs:
+        return 0
+
+    stale_ids = []
+    for job, title, md_content in docs:
+        stale_ids.extend(record_document(
+            manifest,
+            source_file=job["file"],
+            title=title,
+            source_hash=job["source_hash"],
+            markdown_hash=text_sha256(md_content),
+            chunk_ids=[],
+            duplicate_of=job["duplicate_of"],
+            settings=settings
+        ))
+    # Records and vectors from when these documents were converted on their own
+    delete_records(stale_ids)
+    get_document_store().remove([title for _, title, _ in docs])
+    save_manifest(manifest)
+    metrics.inc("documents_total", len(docs), status="duplicate")
+    return len(docs)
+
+def run_conversion_pass(files, manifest, workers=1, asset_dir=None, use_llm_cache=True,
+                        profile_doc=None, metrics_dir=METRICS_DIR, extract_workers=None,
+                        convert_workers=None, embed_workers=1, queue_size=QUEUE_SIZE,
+                        dedup_index=None, settings=None):
+    """
+    PASS 1: Convert DOCX → Markdown and store embeddings.
+
+    Documents stream through four stages connected by bounded queues:
+    extract → convert (chat + save markdown) → embed → store (ChromaDB + manifest).
+    Each stage runs concurrently with the others, so parsing, chat calls and
+    embedding requests for different documents overlap. With more than one
+    extract worker, extraction runs in a process pool. Storage is a single
+    thread, since ChromaDB and manifest writes are serialised anyway; it
+    collects records in a ChromaWriteBuffer and writes CHROMA_WRITE_BATCH records at a
+    time (or fewer, every CHROMA_WRITE_MAX_DOCS documents or CHROMA_WRITE_MAX_SECONDS);
+    documents are recorded in the manifest as soon as their records are written.
+    Output files are the same as a sequential run.
+
+    With a dedup_index, each extracted document is checked, in input order,
+    for near-duplicates of documents already seen (this run or earlier ones). Duplicates skip
+    conversion and embedding; their notes are written from the representative's
+    markdown after the pipeline has drained (see write_duplicates).
+
+    Args:
+        files: List of (file, source_hash) to process
+        manifest: Loaded manifest, updated as documents are stored
+        workers: Default for extract_workers and convert_workers
+        asset_dir: Image store folder (--assets), or None to inline images
+        use_llm_cache: Reuse cached chat responses
+        profile_doc: Title of a document to run under cProfile (stats saved in metrics_dir)
+        extract_workers: Documents extracted concurrently
+        convert_workers: Documents converted concurrently
+        embed_workers: Concurrent embedding requests (groups of up to EMBED_FLUSH_DOCS documents)
+        queue_size: Capacity of each queue between stages
+        dedup_index: DedupIndex for near-duplicate detection, or None to convert every document
+        settings: Settings fingerprint recorded in the manifest with each document
+
+    Returns:
+        (documents converted and stored, near-duplicate notes written)
+    """
+    extract_workers = extract_workers or workers
+    convert_workers = convert_workers or workers
+    write_buffer = ChromaWriteBuffer()
+    duplicates = []
+
+    if dedup_index is not None:
+        # Documents being reprocessed are matched on their new content
+        dedup_index.forget(os.path.splitext(file)[0] for file, _ in files)
+
+    jobs = (
+        {
+            "file": file,
+            "source_hash": source_hash,
+            "ticket": ticket,
+            "profiler": cProfile.Profile() if os.path.splitext(file)[0] == profile_doc else None,
+        }
+        for ticket, (file, source_hash) in enumerate(files)
+    )
+    # Documents are checked for duplicates in input order, whichever worker extracts
+    # them first, so the representative of a cluster is always the first in sorted order
+    dedup_turns = Sequencer()
+
+    # Spawned, not forked: workers are started from pipeline threads that may hold
+    # locks (caches, HTTP pool, metrics), which a forked child would inherit held
+    pool = ProcessPoolExecutor(max_workers=extract_workers, mp_context=multiprocessing.get_context("spawn")) \
+        if extract_workers > 1 else contextlib.nullcontext()
+    with pool as extract_pool:
+        def extract(job):
+            with profiling(job["profiler"]):
+                try:
+                    job["text"], job["images"] = extract_document(job["file"], extract_pool, asset_dir)
+                finally:
+                    # Failed documents still take their turn, or later ones would wait forever
+                    if dedup_index is not None:
+                        with dedup_turns.turn(job["ticket"]):
+                            if "text" in job:
+                                with metrics.timer("pipeline_stage_seconds", stage="dedup"):
+                                    job["duplicate_of"], job["similarity"] = dedup_index.add(
+                                        os.path.splitext(job["file"])[0], job["text"]
+                                    )
+            return job
+
+        def convert(job):
+            if job.get("duplicate_of"):
+                # Written from the representative's note once the pipeline has drained
+                duplicates.append({key: job[key] for key in ("file", "source_hash", "duplicate_of", "similarity")})
+                return None
+            with profiling(job["profiler"]):
+                doc = convert_and_save(job["file"], job["text"], job["images"], job["source_hash"], use_llm_cache)
+            doc["settings"] = settings
+            if job["profiler"] is not None:
+                title = os.path.splitext(job["file"])[0]
+                save_profile(job["profiler"], os.path.join(metrics_dir, f"profile_{title}.prof"))
+            return doc
+
+        progress = tqdm(total=len(files), desc="Processing Word files")
+
+        def on_error(stage, item, error):
+            # Items are jobs before conversion, documents after, and (docs, embedded) groups at storage
+            sources = [doc["metadata"]["source"] for doc in item[0]] if stage == "store" \
+                else [item.get("file") or item["metadata"]["source"]]
+            for source in sources:
+                report_failure(stage, source, error)
+            progress.update(len(sources))
+
+        pipeline = Pipeline(
+            [
+                Stage("extract", extract, workers=extract_workers),
+                Stage("convert", convert, workers=convert_workers),
+                Stage("embed", embed_pending, workers=embed_workers, batch_size=EMBED_FLUSH_DOCS),
+                Stage("store", lambda group: store_embedded(group, manifest, write_buffer)),
+            ],
+            queue_size=queue_size,
+            on_error=on_error
+        )
+        with progress:
+            stored_groups = pipeline.run(jobs, on_result=lambda docs: progress.update(len(docs)))
+            # Write whatever is still buffered
+            with metrics.timer("pipeline_stage_seconds", stage="store"):
+                stored_groups.append(commit_written(write_buffer.flush(), manifest))
+            progress.update(len(stored_groups[-1]))
+            duplicate_count = write_duplicates(duplicates, manifest, settings)
+            progress.update(len(duplicates))
+
+    if dedup_index is not None:
+        dedup_index.save()
+
+    processed_count = sum(len(docs) for docs in stored_groups)
+    metrics.inc("documents_total", processed_count, status="processed")
+    return processed_count, duplicate_count
+
+def main():
+    args = parse_args()
+    os.makedirs(OUTPUT_MD_DIR, exist_ok=True)
+    started_at = datetime.now(timezone.utc)
+    run_start = time.perf_counter()
+
+    # ---- PASS 1: Convert DOCX → Markdown + Store Embeddings ----
+    print("\n Step 1: Converting Word files and storing embeddings...\n")
+    asset_dir = ATTACHMENTS_DIR if args.assets else None
+    if asset_dir:
+        print(f"ℹ  Images will be stored once in {asset_dir} and linked from markdown files\n")
+    else:
+        print("ℹ  Images will be embedded directly in markdown files (no separate image files)\n")
+
+    # Debug: List all files in directory
+    all_files = os.listdir(INPUT_DIR)
+    print(f" Files found in {INPUT_DIR}:")
+    for f in all_files:
+        print(f"   - {f} (ends with .docx: {f.endswith('.docx')})")
+    print()
+
+    manifest = load_manifest()
+    settings = settings_fingerprint(asset_dir)
+    files, skipped_count = select_changed_files(list_input_files(), manifest, force=args.force, settings=settings)
+    metrics.inc("documents_total", skipped_count, status="skipped")
+    dedup_index = None if args.no_dedup else DedupIndex()
+    processed_count, duplicate_count = run_conversion_pass(
+        files, manifest, workers=args.workers, asset_dir=asset_dir,
+        use_llm_cache=not args.no_llm_cache,
+        profile_doc=args.profile_doc, metrics_dir=args.metrics_dir,
+        extract_workers=args.extract_workers, convert_workers=args.convert_workers,
+        embed_workers=args.embed_workers, queue_size=args.queue_size,
+        dedup_index=dedup_index, settings=settings
+    )
+
+    print("\n Step 1 complete: All Markdown files created and embedded.\n")
+    print(f"   Successfully processed: {processed_count} documents")
+    print(f"   Near-duplicates (markdown reused): {duplicate_count} documents")
+    print(f"   Skipped (unchanged): {skipped_count} documents\n")
+
+    gc_report = None
+    if args.gc:
+        print(" Reconciling ChromaDB with the notes in output/markdown...\n")
+        gc_report = reconcile(OUTPUT_MD_DIR, INPUT_DIR, manifest, dedup_index=dedup_index)
+        metrics.inc("gc_records_deleted_total", gc_report["orphan_records"])
+        print(f"   Records scanned: {gc_report['records_scanned']}")
+        print(f"   Orphaned records deleted: {gc_report['orphan_records']}")
+        print(f"   Manifest entries pruned: {gc_report['manifest_entries_pruned']}")
+        if gc_report["notes_without_source"]:
+            print(f"   Notes whose source document is gone (delete them to drop their records):")
+            for title in gc_report["notes_without_source"]:
+                print(f"     - {title}")
+        print()
+
+    # ---- PASS 2: Generate Backlinks (with bidirectional linking) ----
+    print(" Step 2: Generating semantic backlinks...\n")
+
+    # Nearest neighbours from the document vector store (no re-embedding, no
+    # per-note queries). Links from the last run are reused, and only the
+    # documents affected by what changed since are recomputed.
+    with metrics.timer("pipeline_stage_seconds", stage="link"):
+        link_state, affected = compute_link_state(
+            None if args.full_relink else load_link_state(), threshold=0.25, top_k=10
+        )
+    all_links = link_state["links"]
+
+    md_titles = sorted(os.path.splitext(f)[0] for f in os.listdir(OUTPUT_MD_DIR) if f.endswith(".md"))
+    backlink_map = {title: [linked for linked, _ in all_links[title]] for title in md_titles if all_links.get(title)}
+
+    if affected is None:
+        write_titles = md_titles
+        print(f"   Computed links for all {len(all_links)} documents")
+    else:
+        # Notes rewritten in step 1 lost their links section and need it back
+        affected.update(os.path.splitext(file)[0] for file, _ in files)
+        write_titles = [title for title in md_titles if title in affected]
+        print(f"   Links changed for {len(write_titles)} of {len(md_titles)} notes (use --full-relink to recompute all)")
+
+    print("\n Step 3: Creating bidirectional links...\n")
+
+    # Build the full symmetric graph first, then write each affected note once
+    link_graph = build_link_graph(backlink_map)
+    with metrics.timer("pipeline_stage_seconds", stage="link_write"):
+        written_count = write_link_graph(link_graph, OUTPUT_MD_DIR, tqdm(write_titles, desc="Writing links"))
+    # Saved only once the notes reflect it, so an interrupted run is relinked next time
+    save_link_state(link_state)
+    link_pairs = sum(len(v) for v in link_graph.values()) // 2
+
+    print("\n All documents processed with semantic bidirectional linking!")
+    print(f"\nSummary:")
+    print(f"   - Documents processed: {len([f for f in os.listdir(OUTPUT_MD_DIR) if f.endswith('.md')])}")
+    print(f"   - Bidirectional link pairs created: {link_pairs}")
+    print(f"   - Notes rewritten: {written_count}")
+    embed_cache_stats = get_embedding_cache().stats()
+    print(f"   - Embedding cache: {embed_cache_stats['hits']} hits, {embed_cache_stats['misses']} misses ({embed_cache_stats['entries']} cached)")
+    llm_cache_stats = get_llm_cache().stats()
+    print(f"   - Conversion cache: {llm_cache_stats['hits']} hits, {llm_cache_stats['misses']} misses ({llm_cache_stats['entries']} cached)")
+    if asset_dir:
+        print(f"\n Note: Images are stored in {asset_dir}")
+    else:
+        print(f"\n Note: Images are embedded directly in markdown files")
+
+    run_info = {
+        "started_at": started_at.isoformat(),
+        "duration_seconds": time.perf_counter() - run_start,
+        "arguments": vars(args),
+        "documents_processed": processed_count,
+        "documents_skipped": skipped_count,
+        "documents_duplicate": duplicate_count,
+        "link_pairs": link_pairs,
+        "notes_rewritten": written_count,
+        "notes_relinked": len(write_titles),
+        "embedding_cache": embed_cache_stats,
+        "conversion_cache": llm_cache_stats,
+        "gc": gc_report,
+    }
+    metrics.write_json(os.path.join(args.metrics_dir, "run_report.json"), run_info)
+    metrics.write_prometheus(os.path.join(args.metrics_dir, "metrics.prom"))
+    print(f" Metrics written to {args.metrics_dir}")
+
+if __name__ == "__main__":
+    main()
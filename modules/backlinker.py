@@ -1,166 +1,250 @@
-from modules.embedding_manager import collection, generate_embedding, chunk_text
+from modules.embedding_manager import get_collection, get_document_store, get_all_documents, record_parent
+from modules.metrics import metrics
+import config
+import json
 import os
-import re
 import numpy as np
 
-def strip_embedded_images(md_content):
+# Headings that start the generated links section at the end of a note
+BACKLINK_SECTION_MARKERS = ("**Related Notes:**", "**Backlinks:**")
+
+# Links computed on the last run, so the next one only recomputes what changed
+LINK_STATE_PATH = getattr(config, "LINK_STATE_PATH", "./chroma_store/link_state.json")
+# Above this share of changed documents, one full pass is cheaper than patching
+INCREMENTAL_MAX_CHANGED = 0.25
+
+def strip_backlinks_section(md_content):
     """
-    Remove base64 embedded images from markdown to reduce token count.
-    Keeps image placeholders for structure but removes base64 data.
+    Remove the generated Related Notes section from markdown.
+    Returns the note body exactly as it was produced by the converter.
+    """
+    positions = [
+        md_content.find(f"\n\n---\n\n{marker}") for marker in BACKLINK_SECTION_MARKERS
+    ]
+    positions = [p for p in positions if p >= 0]
+    if positions:
+        return md_content[:min(positions)]
+    return md_content
+
+def sync_document_store(batch_size=100):
+    """
+    Make the document vector store match the documents in ChromaDB.
+    Vectors are normally written alongside the chunks (see upsert_records);
+    this drops documents that were deleted and fills in any that are missing,
+    e.g. on the first run after upgrading, from their stored chunk embeddings.
     
-    Args:
-        md_content: Markdown text with embedded images
-        
     Returns:
-        Cleaned markdown text without base64 image data
+        The synced DocumentVectorStore
     """
-    # Pattern to match: ![](data:image/...;base64,LONG_BASE64_STRING)
-    # Replace with: ![](image)
-    pattern = r'!\[\]\(data:image/[^;]+;base64,[A-Za-z0-9+/=]+\)'
-    cleaned = re.sub(pattern, '![](image)', md_content)
-    
-    return cleaned
+    store = get_document_store()
+    titles = get_all_documents()
 
-def generate_backlinks(current_doc, current_title, threshold=0.25, top_k=10):
+    store.remove([doc_id for doc_id in list(store.ids) if doc_id not in titles])
+
+    missing = sorted(titles.difference(store.ids))
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        data = get_collection().get(where={"title": {"$in": batch}}, include=["embeddings", "metadatas"])
+        chunks_by_doc = {}
+        for meta, embedding in zip(data["metadatas"], data["embeddings"]):
+            chunks_by_doc.setdefault(record_parent(meta), []).append(np.asarray(embedding, dtype=np.float32))
+        store.upsert(
+            list(chunks_by_doc),
+            [np.mean(np.stack(chunks), axis=0) for chunks in chunks_by_doc.values()]
+        )
+    return store
+
+def load_link_state(path=LINK_STATE_PATH):
     """
-    Find semantically similar docs and return backlinks.
-    Uses chunking + averaging strategy for long documents.
-    
+    Load the links computed on the last run.
+
+    Returns:
+        {"threshold", "top_k", "fingerprints": {title: vector hash},
+         "links": {title: [(linked title, distance), nearest first]}}, or None
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    state["links"] = {title: [tuple(hit) for hit in hits] for title, hits in state["links"].items()}
+    return state
+
+def save_link_state(state, path=LINK_STATE_PATH):
+    """Write the link state atomically."""
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    data = json.dumps(state)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(f"{path}.tmp", path)
+    metrics.inc("bytes_written_total", len(data.encode("utf-8")), kind="link_state")
+
+def nearest_stored(store, titles, threshold, top_k, sq_norms):
+    """Top-k neighbours of stored documents, {title: [(linked title, distance)]}."""
+    if not titles:
+        return {}
+    queries = np.stack([store.get(title) for title in titles])
+    rows = np.array([store.positions[title] for title in titles])
+    hits = store.nearest(queries, top_k=top_k, threshold=threshold, exclude=rows, sq_norms=sq_norms)
+    return dict(zip(titles, hits))
+
+def affected_notes(old_links, new_links):
+    """
+    Notes whose Related Notes section changes between two link maps:
+    every document whose own links changed, plus the documents it linked
+    to before or after (their incoming links changed).
+    """
+    affected = set()
+    for title in set(old_links) | set(new_links):
+        old_targets = [linked for linked, _ in old_links.get(title, [])]
+        new_targets = [linked for linked, _ in new_links.get(title, [])]
+        if old_targets != new_targets:
+            affected.add(title)
+            affected.update(old_targets)
+            affected.update(new_targets)
+    return affected
+
+def compute_link_state(previous=None, threshold=0.25, top_k=10):
+    """
+    Compute every document's nearest neighbours, reusing the previous run's links.
+
+    Documents whose vector is new or changed since previous (compared by
+    fingerprint) get their neighbours recomputed, as do documents that
+    linked to a changed or deleted document. Every other document keeps its
+    links, except that a changed document joins its top_k if it is now
+    closer than its current links; that takes one blocked pass over the
+    store with only the changed vectors as queries. Without previous state,
+    when the settings differ, or when many documents changed, all links are
+    computed from scratch.
+
     Args:
-        current_doc: The full text of the current document
-        current_title: Title of the current document (to exclude self-references)
-        threshold: Similarity threshold (distance-based, lower = more similar)
-        top_k: Number of results to retrieve
-    
+        previous: State from load_link_state, or None for a full computation
+        threshold: Maximum distance for a link (lower = more similar)
+        top_k: Maximum links per document
+
     Returns:
-        String containing backlinks in Obsidian format
+        (new state, set of titles whose Related Notes may have changed,
+         or None when everything was recomputed)
     """
-    # Strip embedded images before creating embedding
-    cleaned_doc = strip_embedded_images(current_doc)
-    
-    # Check if document needs chunking
-    chunks = chunk_text(cleaned_doc, max_tokens=6000, overlap=200)
-    
-    if len(chunks) == 1:
-        # Single chunk - process normally
-        current_embedding = generate_embedding(chunks[0])
-    else:
-        # Multiple chunks - average their embeddings
-        print(f"    📊 Generating embedding from {len(chunks)} chunks...")
-        chunk_embeddings = []
-        for i, chunk in enumerate(chunks):
-            chunk_emb = generate_embedding(chunk)
-            chunk_embeddings.append(chunk_emb)
-        
-        # Average all chunk embeddings to get document-level embedding
-        current_embedding = np.mean(chunk_embeddings, axis=0).tolist()
-
-    results = collection.query(
-        query_embeddings=[current_embedding],
-        n_results=top_k
+    store = sync_document_store()
+    fingerprints = store.fingerprints()
+    state = {"threshold": threshold, "top_k": top_k, "fingerprints": fingerprints}
+
+    if previous is not None and (previous["threshold"] != threshold or previous["top_k"] != top_k):
+        previous = None
+    if previous is not None:
+        changed = {title for title, fingerprint in fingerprints.items() if previous["fingerprints"].get(title) != fingerprint}
+        removed = set(previous["fingerprints"]) - set(fingerprints)
+        if len(changed) > INCREMENTAL_MAX_CHANGED * max(1, len(fingerprints)):
+            previous = None
+
+    if previous is None:
+        state["links"] = store.nearest_all(threshold=threshold, top_k=top_k)
+        return state, None
+
+    old_links = previous["links"]
+    if not changed and not removed:
+        state["links"] = old_links
+        return state, set()
+
+    links = {title: hits for title, hits in old_links.items() if title in fingerprints and title not in changed}
+    sq_norms = store.squared_norms()
+
+    # Documents that linked to a changed or deleted document may have a new nearest set
+    stale = sorted(
+        title for title, hits in links.items()
+        if any(linked in changed or linked in removed for linked, _ in hits)
     )
+    changed_titles = sorted(changed)
+    links.update(nearest_stored(store, changed_titles + stale, threshold, top_k, sq_norms))
 
-    backlinks = []
-    seen_docs = set()  # Track unique parent documents
-    
-    for meta, dist in zip(results["metadatas"][0], results["distances"][0]):
-        # Determine the document title (handle both chunks and full docs)
-        if 'parent_doc' in meta:
-            doc_title = meta['parent_doc']
-        else:
-            doc_title = meta['title']
-        
-        # Skip self-references
-        if doc_title == current_title:
-            continue
-        
-        # Skip duplicates (multiple chunks from same doc)
-        if doc_title in seen_docs:
-            continue
-        
-        # Check similarity threshold
-        if dist < threshold:  # Lower distance = higher similarity
-            backlinks.append(doc_title)
-            seen_docs.add(doc_title)
-
-    if backlinks:
-        backlink_text = "\n\n---\n\n**Related Notes:**\n" + "\n".join([f"- [[{b}]]" for b in backlinks])
-        return backlink_text
+    # Changed documents entering the top_k of documents that otherwise kept their links
+    if changed_titles:
+        recomputed = set(changed_titles).union(stale)
+        queries = np.stack([store.get(title) for title in changed_titles])
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        candidates = {}
+        for start, block in store.iter_blocks():
+            distances = sq_norms[start:start + len(block), None] + query_norms[None, :] - 2.0 * (block @ queries.T)
+            for i, j in zip(*np.nonzero(distances < threshold)):
+                title = store.ids[start + i]
+                if title not in recomputed:
+                    candidates.setdefault(title, []).append((changed_titles[j], float(distances[i, j])))
+        for title, hits in candidates.items():
+            links[title] = sorted(links.get(title, []) + hits, key=lambda hit: hit[1])[:top_k]
+
+    state["links"] = links
+    return state, affected_notes(old_links, links)
+
+def format_backlinks(linked_titles):
+    """Render the Related Notes section for a list of titles."""
+    if linked_titles:
+        return "\n\n---\n\n**Related Notes:**\n" + "\n".join([f"- [[{b}]]" for b in linked_titles])
     return ""
 
-def get_existing_backlinks(md_content):
+def build_link_graph(backlink_map):
     """
-    Extract existing backlinks from markdown content.
-    Returns list of note titles that are already linked.
-    """
-    backlinks = []
-    in_backlinks_section = False
+    Make links symmetric: if A links to B, B also links to A.
+    
+    Args:
+        backlink_map: Dictionary {source_title: [target_titles]}
     
-    for line in md_content.split('\n'):
-        if '**Related Notes:**' in line or '**Backlinks:**' in line:
-            in_backlinks_section = True
-            continue
-        
-        if in_backlinks_section:
-            if line.startswith('- [[') and line.endswith(']]'):
-                # Extract title from [[Title]]
-                title = line[4:-2]  # Remove '- [[' and ']]'
-                backlinks.append(title)
-            elif line.strip() and not line.startswith('-'):
-                # End of backlinks section
-                break
+    Returns:
+        Dictionary {title: [linked titles]} with each note's own links first,
+        then incoming links, without duplicates or self-links
+    """
+    graph = {}
+    for source_title, target_titles in backlink_map.items():
+        graph.setdefault(source_title, {}).update(dict.fromkeys(target_titles))
+
+    for source_title in sorted(backlink_map):
+        for target_title in backlink_map[source_title]:
+            graph.setdefault(target_title, {})[source_title] = None
+
+    return {
+        title: [linked for linked in linked_titles if linked != title]
+        for title, linked_titles in graph.items()
+    }
+
+def write_note_links(md_path, linked_titles):
+    """
+    Replace a note's Related Notes section in a single write.
+    The file is only touched if its content changes, and is replaced
+    atomically so a crash never leaves a half-written note.
     
-    return backlinks
+    Returns:
+        True if the file was rewritten
+    """
+    with open(md_path, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    updated = strip_backlinks_section(content) + format_backlinks(linked_titles)
+    if updated == content:
+        return False
 
-def update_bidirectional_links(source_title, target_titles, output_dir):
+    tmp_path = f"{md_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(updated)
+    os.replace(tmp_path, md_path)
+    metrics.inc("bytes_written_total", len(updated.encode("utf-8")), kind="markdown_links")
+    return True
+
+def write_link_graph(graph, output_dir, titles):
     """
-    Update target documents to include backlinks to source document.
+    Write the link graph into the markdown files, one write per changed file.
     
     Args:
-        source_title: Title of the document that links to targets
-        target_titles: List of document titles that should link back
+        graph: Dictionary {title: [linked titles]} (see build_link_graph)
         output_dir: Directory containing markdown files
+        titles: Titles of the notes to write
+    
+    Returns:
+        Number of files rewritten
     """
-    for target_title in target_titles:
-        target_path = os.path.join(output_dir, f"{target_title}.md")
-        
-        # Skip if target file doesn't exist
-        if not os.path.exists(target_path):
-            continue
-        
-        # Read target file
-        with open(target_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        
-        # Check if backlink already exists
-        existing_backlinks = get_existing_backlinks(content)
-        
-        if source_title in existing_backlinks:
-            # Already has this backlink
-            continue
-        
-        # Add backlink to target
-        if '**Related Notes:**' in content or '**Backlinks:**' in content:
-            # Backlinks section exists, append to it
-            lines = content.split('\n')
-            insert_idx = None
-            
-            for i, line in enumerate(lines):
-                if '**Related Notes:**' in line or '**Backlinks:**' in line:
-                    # Find the end of the backlinks section
-                    j = i + 1
-                    while j < len(lines) and (lines[j].startswith('-') or not lines[j].strip()):
-                        j += 1
-                    insert_idx = j - 1
-                    break
-            
-            if insert_idx is not None:
-                lines.insert(insert_idx + 1, f"- [[{source_title}]]")
-                content = '\n'.join(lines)
-        else:
-            # No backlinks section, create one
-            content += f"\n\n---\n\n**Related Notes:**\n- [[{source_title}]]"
-        
-        # Write updated content
-        with open(target_path, "w", encoding="utf-8") as f:
-            f.write(content)
\ No newline at end of file
+    written = 0
+    for title in titles:
+        md_path = os.path.join(output_dir, f"{title}.md")
+        if write_note_links(md_path, graph.get(title, [])):
+            written += 1
+    return written
@@ -0,0 +1,129 @@
+import re
+import threading
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+def get_tokenizer():
+    """
+    Return the shared tokenizer for chunking, packing and token budgets.
+    It is loaded on first use, since loading the encoding takes a moment.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                import tiktoken
+                _tokenizer = tiktoken.get_encoding("cl100k_base")
+    return _tokenizer
+
+def split_tokens(tokens, max_tokens, overlap=0):
+    """
+    Slice a token list into windows of at most max_tokens.
+
+    Args:
+        tokens: Token ids (from get_tokenizer().encode)
+        max_tokens: Window size
+        overlap: Tokens shared between consecutive windows
+
+    Returns:
+        List of token lists
+    """
+    windows = []
+    start = 0
+    while start < len(tokens):
+        end = start + max_tokens
+        windows.append(tokens[start:end])
+        if end >= len(tokens):
+            break
+        # Move start forward, accounting for overlap
+        start = end - overlap
+    return windows
+
+def is_heading(block):
+    """True for a block that is only a markdown heading line."""
+    return "\n" not in block and re.match(r"#{1,6}\s", block.lstrip()) is not None
+
+def join_pieces(pieces):
+    """Join (text, tokens, separator) pieces, dropping the first one's separator."""
+    return pieces[0][0] + "".join(separator + piece for piece, _, separator in pieces[1:])
+
+def split_blocks(text):
+    """
+    Split text into structural blocks: paragraphs, tables and headed sections.
+    Blocks end at blank lines, and a markdown heading always starts a new block.
+    Table rows (separated by single newlines) stay together.
+    """
+    blocks = []
+    for block in re.split(r"\n\s*\n", text):
+        current = []
+        for line in block.split("\n"):
+            if line.lstrip().startswith("#") and current:
+                blocks.append("\n".join(current))
+                current = []
+            current.append(line)
+        if current:
+            blocks.append("\n".join(current))
+    return [block for block in blocks if block.strip()]
+
+def chunk_by_tokens(text, max_tokens):
+    """
+    Pack whole blocks (see split_blocks) into chunks of at most max_tokens,
+    without overlap. Blocks larger than the budget are split by line, and
+    lines larger than the budget by token windows. A heading that would end
+    a chunk starts the next one instead, so it stays with its section.
+
+    Each line is encoded once; block and text sizes are sums of their lines.
+
+    Args:
+        text: Text to split
+        max_tokens: Token budget per chunk
+
+    Returns:
+        List of chunk strings
+    """
+    tokenizer = get_tokenizer()
+    blocks = []
+    for block in split_blocks(text):
+        lines = [(line, tokenizer.encode(line)) for line in block.split("\n")]
+        # Separators (newlines) are at most one token each
+        block_tokens = sum(len(line_tokens) for _, line_tokens in lines) + len(lines) - 1
+        blocks.append((block, block_tokens, lines))
+    if sum(block_tokens for _, block_tokens, _ in blocks) + len(blocks) - 1 <= max_tokens:
+        return [text] if text.strip() else []
+
+    pieces = []
+    for block, block_tokens, lines in blocks:
+        if block_tokens <= max_tokens:
+            pieces.append((block, block_tokens, "\n\n"))
+            continue
+
+        separator = "\n\n"
+        for line, line_tokens in lines:
+            if len(line_tokens) <= max_tokens:
+                pieces.append((line, len(line_tokens), separator))
+            else:
+                for window in split_tokens(line_tokens, max_tokens):
+                    pieces.append((tokenizer.decode(window), len(window), separator))
+                    separator = ""
+            separator = "\n"
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece, piece_tokens, separator in pieces:
+        # Separators are at most one token each
+        if current and current_tokens + piece_tokens + 1 > max_tokens:
+            carried = []
+            heading, heading_tokens, _ = current[-1]
+            if len(current) > 1 and is_heading(heading) and heading_tokens + piece_tokens + 1 <= max_tokens:
+                carried = [current.pop()]
+            chunks.append(join_pieces(current))
+            current = carried
+            current_tokens = heading_tokens if carried else 0
+        current.append((piece, piece_tokens, separator))
+        current_tokens += piece_tokens + (1 if len(current) > 1 else 0)
+
+    if current:
+        chunks.append(join_pieces(current))
+    return chunks
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import numpy as np
+import config
+
+# Documents at least this similar (estimated Jaccard similarity of their word
+# shingles) are treated as copies of one another and converted only once
+DEDUP_THRESHOLD = getattr(config, "DEDUP_THRESHOLD", 0.9)
+DEDUP_INDEX_PATH = getattr(config, "DEDUP_INDEX_PATH", "./chroma_store/dedup_index.json")
+
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+# 16 bands of 8 rows: pairs above ~0.7 similarity almost always share a band,
+# and candidates are then checked against DEDUP_THRESHOLD
+LSH_BANDS = 16
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_permutations = np.random.RandomState(1).randint(1, 1 << 31, size=(2, NUM_PERM)).astype(np.uint64)
+
+def normalize_text(text):
+    """Lowercased words of a document, without image data and punctuation."""
+    text = re.sub(r'!\[[^\]]*\]\([^)]*\)', ' ', text)
+    return re.findall(r'\w+', text.lower())
+
+def shingle_hashes(words, size=SHINGLE_WORDS):
+    """Stable 32-bit hashes of the document's overlapping word sequences."""
+    if len(words) < size:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+        dtype=np.uint64
+    )
+
+def minhash_signature(text, block_size=4096):
+    """
+    MinHash signature of a document: for each of NUM_PERM hash functions,
+    the minimum over its shingles. The fraction of equal positions between
+    two signatures estimates the Jaccard similarity of their shingle sets.
+    Returns None for documents without any words.
+    """
+    words = normalize_text(text)
+    if not words:
+        return None
+    hashes = shingle_hashes(words)
+    a, b = _permutations
+    signature = np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint64)
+    for start in range(0, len(hashes), block_size):
+        block = hashes[start:start + block_size, None]
+        permuted = ((block * a + b) % _MERSENNE_PRIME) & 0xFFFFFFFF
+        signature = np.minimum(signature, permuted.min(axis=0))
+    return signature.astype(np.uint32)
+
+def similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity of two documents from their signatures."""
+    return float(np.mean(signature_a == signature_b))
+
+class DedupIndex:
+    """
+    Near-duplicate detection over every document the pipeline has seen.
+
+    Each document's MinHash signature is split into LSH_BANDS bands; documents
+    sharing a band are candidates and are compared on the full signature.
+    The first document of a cluster becomes its representative. Later
+    near-duplicates map to it, and only representatives are matched against,
+    so clusters never chain. Signatures and the mapping persist in a JSON
+    file, so new copies of documents converted on earlier runs are found too.
+
+    Args:
+        path: JSON file holding the index
+        threshold: Minimum estimated similarity for a duplicate
+    """
+
+    def __init__(self, path=DEDUP_INDEX_PATH, threshold=DEDUP_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.signatures = {}
+        self.duplicate_of = {}
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            self.signatures = {
+                title: np.frombuffer(bytes.fromhex(signature), dtype=np.uint32)
+                for title, signature in index["signatures"].items()
+            }
+            self.duplicate_of = index["duplicate_of"]
+            for title, signature in self.signatures.items():
+                if title not in self.duplicate_of:
+                    self._add_to_buckets(title, signature)
+
+    @staticmethod
+    def _bands(signature):
+        rows = NUM_PERM // LSH_BANDS
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(LSH_BANDS)]
+
+    def _add_to_buckets(self, title, signature):
+        for key in self._bands(signature):
+            self.buckets.setdefault(key, set()).add(title)
+
+    def _remove_from_buckets(self, title):
+        signature = self.signatures.get(title)
+        if signature is None or title in self.duplicate_of:
+            return
+        for key in self._bands(signature):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(title)
+                if not bucket:
+                    del self.buckets[key]
+
+    def forget(self, titles):
+        """
+        Drop documents, e.g. ones about to be processed again (so they are
+        matched on their new content) or deleted. Their duplicates that are
+        kept become representatives themselves, so later copies still match them.
+        """
+        titles = set(titles)
+        with self._lock:
+            for title in titles:
+                self._remove_from_buckets(title)
+                self.signatures.pop(title, None)
+                self.duplicate_of.pop(title, None)
+            for duplicate, representative in list(self.duplicate_of.items()):
+                if representative in titles:
+                    del self.duplicate_of[duplicate]
+                    self._add_to_buckets(duplicate, self.signatures[duplicate])
+
+    def find_representative(self, signature, exclude=None):
+        """Return (representative title, similarity) of the closest match above the threshold, or (None, 0.0)."""
+        candidates = set()
+        for key in self._bands(signature):
+            candidates.update(self.buckets.get(key, ()))
+        candidates.discard(exclude)
+
+        best, best_similarity = None, 0.0
+        for title in sorted(candidates):
+            score = similarity(signature, self.signatures[title])
+            if score >= self.threshold and score > best_similarity:
+                best, best_similarity = title, score
+        return best, best_similarity
+
+    def add(self, title, text):
+        """
+        Index a document and decide whether it duplicates one already seen.
+
+        Returns:
+            (representative title, similarity) if title is a near-duplicate, else (None, 0.0)
+        """
+        signature = minhash_signature(text)
+        with self._lock:
+            self._remove_from_buckets(title)
+            self.duplicate_of.pop(title, None)
+            if signature is None:
+                self.signatures.pop(title, None)
+                return None, 0.0
+            representative, score = self.find_representative(signature, exclude=title)
+            self.signatures[title] = signature
+            if representative is not None:
+                self.duplicate_of[title] = representative
+            else:
+                self._add_to_buckets(title, signature)
+            return representative, score
+
+    def prune(self, live_titles):
+        """Forget documents whose notes no longer exist."""
+        self.forget([title for title in list(self.signatures) if title not in live_titles])
+
+    def save(self):
+        """Write the index atomically."""
+        with self._lock:
+            data = json.dumps({
+                "signatures": {title: signature.tobytes().hex() for title, signature in self.signatures.items()},
+                "duplicate_of": self.duplicate_of,
+            })
+        parent = os.path.dirname(self.path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(f"{self.path}.tmp", self.path)
+
+def duplicate_markdown(title, representative, representative_body, score):
+    """
+    Note for a near-duplicate document: the representative's converted
+    markdown under the duplicate's own title, with a link back to it.
+    """
+    heading = f"# {representative}\n\n"
+    body = representative_body[len(heading):] if representative_body.startswith(heading) else representative_body
+    notice = f"> Near-duplicate of [[{representative}]] ({score:.0%} similar); converted content reused from that note.\n\n"
+    return f"# {title}\n\n{notice}{body}"
@@ -0,0 +1,126 @@
+import os
+import sqlite3
+import threading
+import time
+from modules.metrics import metrics
+
+
+class DiskCache:
+    """
+    Persistent key/value cache backed by a single SQLite file.
+    Entries are evicted least-recently-used once max_entries is exceeded.
+
+    Args:
+        path: Location of the SQLite file (parent folder is created if missing)
+        max_entries: Maximum number of entries kept on disk
+        name: Label for this cache in run metrics (cache_requests_total)
+    """
+
+    def __init__(self, path, max_entries=50000, name=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON cache(last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        """Return the cached bytes for key, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.inc("cache_requests_total", cache=self.name, result="miss")
+                return None
+
+            self._conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            metrics.inc("cache_requests_total", cache=self.name, result="hit")
+            return row[0]
+
+    def get_many(self, keys):
+        """Return a dict of {key: bytes} for every key present in the cache."""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+
+        with self._lock:
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE cache SET last_access = ? WHERE key = ?",
+                [(now, key) for key in found]
+            )
+            self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(unique_keys) - len(found)
+
+        metrics.inc("cache_requests_total", len(found), cache=self.name, result="hit")
+        metrics.inc("cache_requests_total", len(unique_keys) - len(found), cache=self.name, result="miss")
+
+        return found
+
+    def set(self, key, value):
+        """Store bytes under key, evicting old entries if the cache is full."""
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        """Store several {key: bytes} entries in one transaction."""
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, last_access) VALUES (?, ?, ?)",
+                [(key, value, now) for key, value in items.items()]
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return hit/miss counters and the current number of entries."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
@@ -1,84 +1,289 @@
-from docx import Document
-from docx.oxml.text.paragraph import CT_P
-from docx.oxml.table import CT_Tbl
-from docx.table import _Cell, Table
-from docx.text.paragraph import Paragraph
 import base64
+import hashlib
+import os
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from modules.metrics import metrics
 
-def extract_text_and_images(docx_path):
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+A_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+R_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+CT_NS = "{http://schemas.openxmlformats.org/package/2006/content-types}"
+MC_NS = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+
+def save_image_asset(image_blob, partname, asset_dir):
+    """
+    Write an image to the asset store, named by the hash of its content.
+    Identical images (e.g. logos reused across documents) are stored once.
+
+    Returns:
+        File name of the stored image inside asset_dir
+    """
+    ext = os.path.splitext(partname)[1].lower() or ".bin"
+    file_name = hashlib.sha256(image_blob).hexdigest() + ext
+    asset_path = os.path.join(asset_dir, file_name)
+
+    if not os.path.exists(asset_path):
+        os.makedirs(asset_dir, exist_ok=True)
+        # Write under a unique temp name so parallel extractions never see a partial file
+        tmp_path = f"{asset_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image_blob)
+        os.replace(tmp_path, asset_path)
+        metrics.inc("bytes_written_total", len(image_blob), kind="asset")
+
+    return file_name
+
+def load_image_relationships(docx_zip):
+    """
+    Read the image relationships of the main document part.
+
+    Returns:
+        Dictionary {relationship id: (zip member name or URL, is_external)}
+    """
+    rels = {}
+    try:
+        rels_xml = docx_zip.read("word/_rels/document.xml.rels")
+    except KeyError:
+        return rels
+
+    for rel in ET.fromstring(rels_xml).iter(f"{PKG_REL_NS}Relationship"):
+        if "image" not in rel.get("Type", ""):
+            continue
+        target = rel.get("Target", "")
+        if rel.get("TargetMode") == "External":
+            rels[rel.get("Id")] = (target, True)
+        elif target.startswith("/"):
+            rels[rel.get("Id")] = (target.lstrip("/"), False)
+        else:
+            rels[rel.get("Id")] = (posixpath.normpath(posixpath.join("word", target)), False)
+    return rels
+
+def load_content_types(docx_zip):
+    """
+    Read [Content_Types].xml.
+
+    Returns:
+        Function mapping a zip member name to its content type
+    """
+    defaults = {}
+    overrides = {}
+    try:
+        types_xml = docx_zip.read("[Content_Types].xml")
+    except KeyError:
+        types_xml = None
+
+    if types_xml is not None:
+        for entry in ET.fromstring(types_xml):
+            if entry.tag == f"{CT_NS}Default":
+                defaults[entry.get("Extension", "").lower()] = entry.get("ContentType")
+            elif entry.tag == f"{CT_NS}Override":
+                overrides[entry.get("PartName", "").lstrip("/")] = entry.get("ContentType")
+
+    def content_type(member):
+        ext = posixpath.splitext(member)[1].lstrip(".").lower()
+        return overrides.get(member) or defaults.get(ext) or f"image/{ext or 'png'}"
+    return content_type
+
+def iter_content(element):
+    """
+    Like element.iter(), but skips mc:Fallback subtrees: Word writes textbox
+    and shape content both in mc:Choice and again in mc:Fallback (for older
+    readers), so reading both would repeat its text and images.
+    """
+    yield element
+    for child in element:
+        if child.tag != f"{MC_NS}Fallback":
+            yield from iter_content(child)
+
+def paragraph_parts(paragraph):
+    """
+    Split a <w:p> element into ordered text and image parts.
+
+    Returns:
+        List of ("text", str) and ("image", relationship id) tuples
+    """
+    parts = []
+    buffer = []
+
+    for node in iter_content(paragraph):
+        if node.tag == f"{W_NS}t":
+            buffer.append(node.text or "")
+        elif node.tag == f"{W_NS}tab":
+            buffer.append("\t")
+        elif node.tag in (f"{W_NS}br", f"{W_NS}cr"):
+            buffer.append("\n")
+        elif node.tag == f"{A_NS}blip":
+            embed_id = node.get(f"{R_NS}embed")
+            if embed_id:
+                parts.append(("text", "".join(buffer)))
+                parts.append(("image", embed_id))
+                buffer = []
+
+    parts.append(("text", "".join(buffer)))
+    return [(kind, value) for kind, value in parts if kind == "image" or value.strip()]
+
+def heading_level(paragraph):
+    """
+    Markdown heading level of a <w:p> element from its paragraph style
+    (Title is 1, Heading1-Heading6 map to their number), or 0 for body text.
+    """
+    style = paragraph.find(f"{W_NS}pPr/{W_NS}pStyle")
+    style_id = style.get(f"{W_NS}val", "") if style is not None else ""
+    if style_id == "Title":
+        return 1
+    if style_id.startswith("Heading") and style_id[len("Heading"):].isdigit():
+        return min(int(style_id[len("Heading"):]), 6)
+    return 0
+
+def cell_text(cell):
+    """Text of a <w:tc> element: its own paragraphs joined by newlines."""
+    paragraphs = []
+    for paragraph in cell.findall(f"{W_NS}p"):
+        paragraphs.append("".join(value for kind, value in paragraph_parts(paragraph) if kind == "text"))
+    return "\n".join(paragraphs)
+
+def table_text(table):
+    """
+    Render a <w:tbl> element as pipe-separated rows.
+    Horizontally merged cells appear once; vertically merged continuation
+    cells are left empty instead of repeating the merged text.
+    """
+    text = "\n"
+    for row in table.findall(f"{W_NS}tr"):
+        cells = []
+        for cell in row.findall(f"{W_NS}tc"):
+            v_merge = cell.find(f"{W_NS}tcPr/{W_NS}vMerge")
+            if v_merge is not None and v_merge.get(f"{W_NS}val", "continue") == "continue":
+                cells.append("")
+            else:
+                cells.append(cell_text(cell).strip())
+        text += " | ".join(cells) + "\n"
+    return text
+
+def iter_document_parts(docx_path, asset_dir=None, asset_link_dir="attachments"):
+    """
+    Stream the content of a Word document IN ORDER without loading it all.
+    word/document.xml is parsed incrementally and each body element is freed
+    once processed; images are read from the zip only when referenced.
+
+    Args:
+        docx_path: Path to the .docx file
+        asset_dir: If given, images are written to this folder (named by content
+                   hash) and referenced by path instead of being inlined as base64
+        asset_link_dir: Folder prefix used in the markdown image links in asset mode
+
+    Yields:
+        ("text", paragraph text), ("table", table text) or ("image", image URL)
+    """
+    with zipfile.ZipFile(docx_path) as docx_zip:
+        image_rels = load_image_relationships(docx_zip)
+        content_type = load_content_types(docx_zip)
+        image_urls = {}
+
+        def resolve_image(embed_id):
+            # Each relationship is read and encoded at most once per document
+            if embed_id in image_urls:
+                return image_urls[embed_id]
+
+            url = None
+            if embed_id not in image_rels:
+                pass
+            elif image_rels[embed_id][1]:
+                print(f"    ⚠️  Skipping external image link")
+            else:
+                member = image_rels[embed_id][0]
+                try:
+                    image_blob = docx_zip.read(member)
+                    if asset_dir is not None:
+                        file_name = save_image_asset(image_blob, member, asset_dir)
+                        url = f"{asset_link_dir}/{file_name}"
+                        print(f"    ✓ Stored image {member} as {file_name}")
+                    else:
+                        base64_data = base64.b64encode(image_blob).decode('utf-8')
+                        url = f"data:{content_type(member)};base64,{base64_data}"
+                        print(f"    ✓ Embedded image {member} ({len(base64_data)} bytes)")
+                except Exception as e:
+                    print(f"    ⚠️  Could not embed image {member}: {str(e)}")
+
+            image_urls[embed_id] = url
+            return url
+
+        def block_parts(element):
+            if element.tag == f"{W_NS}p":
+                # Headings are marked up so chunking keeps them with their section
+                prefix = "#" * heading_level(element)
+                for kind, value in paragraph_parts(element):
+                    if kind == "text":
+                        yield "text", f"{prefix} {value.strip()}" if prefix else value.strip()
+                    else:
+                        url = resolve_image(value)
+                        if url:
+                            yield "image", url
+            elif element.tag == f"{W_NS}tbl":
+                yield "table", table_text(element)
+            elif element.tag == f"{W_NS}sdt":
+                # Content controls wrap ordinary paragraphs and tables
+                content = element.find(f"{W_NS}sdtContent")
+                if content is not None:
+                    for child in content:
+                        yield from block_parts(child)
+
+        with docx_zip.open("word/document.xml") as document_xml:
+            depth = 0
+            body = None
+            for event, element in ET.iterparse(document_xml, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if depth == 2 and element.tag == f"{W_NS}body":
+                        body = element
+                    continue
+
+                if depth == 3 and body is not None:
+                    yield from block_parts(element)
+                    # Drop the processed element so memory stays bounded
+                    body.remove(element)
+                depth -= 1
+
+def extract_text_and_images(docx_path, asset_dir=None, asset_link_dir="attachments"):
     """
     Extracts text and images from a Word document IN ORDER.
     Returns images as base64 data URLs positioned where they appear in the document.
-    
+
+    Args:
+        docx_path: Path to the .docx file
+        asset_dir: If given, images are written to this folder (named by content
+                   hash) and referenced by path instead of being inlined as base64
+        asset_link_dir: Folder prefix used in the markdown image links in asset mode
+
     Returns:
         text: Full document text with image markers
-        image_map: Dictionary mapping image markers to base64 data URLs
-    """
-    doc = Document(docx_path)
-    
-    # Build image reference map first
-    image_map = {}
-    for i, rel in enumerate(doc.part.rels.values()):
-        if "image" in rel.reltype:
-            if rel.is_external:
-                print(f"    ⚠️  Skipping external image link")
-                continue
-            
-            try:
-                image_blob = rel.target_part.blob
-                base64_data = base64.b64encode(image_blob).decode('utf-8')
-                content_type = rel.target_part.content_type
-                data_url = f"data:{content_type};base64,{base64_data}"
-                
-                # Store by relationship ID
-                image_map[rel.target_part.partname] = data_url
-                print(f"    ✓ Embedded image {i+1} ({len(base64_data)} bytes)")
-                
-            except Exception as e:
-                print(f"    ⚠️  Could not embed image {i+1}: {str(e)}")
-                continue
-    
-    # Extract content in order (paragraphs, tables, images)
+        image_map: Always empty; images are inline in the text
+    """
     content_parts = []
-    
-    for element in doc.element.body:
-        if isinstance(element, CT_P):
-            para = Paragraph(element, doc)
-            
-            # Check if paragraph contains an image
-            has_image = False
-            for run in para.runs:
-                for drawing in run.element.findall('.//{http://schemas.openxmlformats.org/wordprocessingml/2006/main}drawing'):
-                    # Extract image reference
-                    for blip in drawing.findall('.//{http://schemas.openxmlformats.org/drawingml/2006/main}blip'):
-                        embed_id = blip.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed')
-                        if embed_id:
-                            try:
-                                rel = doc.part.rels[embed_id]
-                                img_part_name = rel.target_part.partname
-                                
-                                if img_part_name in image_map:
-                                    # Add image inline
-                                    content_parts.append(f"\n![Image]({image_map[img_part_name]})\n")
-                                    has_image = True
-                            except:
-                                pass
-            
-            # Add text if paragraph has content and no image
-            if not has_image and para.text.strip():
-                content_parts.append(para.text.strip())
-        
-        elif isinstance(element, CT_Tbl):
-            table = Table(element, doc)
-            # Simple table text extraction
-            table_text = "\n"
-            for row in table.rows:
-                row_text = " | ".join(cell.text.strip() for cell in row.cells)
-                table_text += row_text + "\n"
-            content_parts.append(table_text)
-    
+
+    for kind, value in iter_document_parts(docx_path, asset_dir, asset_link_dir):
+        if kind == "image":
+            # Add image inline
+            content_parts.append(f"\n![Image]({value})\n")
+        else:
+            content_parts.append(value)
+
     full_text = "\n\n".join(content_parts)
-    
+
     # Return text with inline images already embedded
     # Return empty list since images are now inline
     return full_text, []
+
+def extract_in_worker(docx_path, asset_dir=None):
+    """
+    extract_text_and_images for a worker process. Metrics recorded in the
+    worker (e.g. asset bytes written) are returned with the result, so the
+    parent can merge them into its own registry.
+
+    Returns:
+        ((text, image_map), drained worker metrics)
+    """
+    return extract_text_and_images(docx_path, asset_dir=asset_dir), metrics.drain()
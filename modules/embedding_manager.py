@@ -1,112 +1,426 @@
-from openai import AzureOpenAI
-from config import *
-import chromadb
+from modules.disk_cache import DiskCache
+from modules.chunking import get_tokenizer, split_tokens
+from modules.metrics import metrics
+from modules.providers import get_provider
+from modules.vector_store import DocumentVectorStore
+from array import array
+import config
+import hashlib
+import numpy as np
 import os
-import tiktoken
+import re
+import threading
+import time
 
-chroma_client = chromadb.PersistentClient(path="./chroma_store/chroma_data")
-collection = chroma_client.get_or_create_collection(name="confluence_notes")
+CHROMA_PATH = getattr(config, "CHROMA_PATH", "./chroma_store/chroma_data")
+COLLECTION_NAME = "confluence_notes"
 
-client = AzureOpenAI(
-    api_key=AZURE_OPENAI_API_KEY,
-    api_version=AZURE_OPENAI_API_VERSION,
-    azure_endpoint=AZURE_OPENAI_ENDPOINT
-)
+# Request packing limits for batched embedding calls
+EMBED_BATCH_MAX_INPUTS = getattr(config, "EMBED_BATCH_MAX_INPUTS", 16)
+EMBED_BATCH_MAX_TOKENS = getattr(config, "EMBED_BATCH_MAX_TOKENS", 100000)
 
-# Initialize tokenizer for chunking
-tokenizer = tiktoken.get_encoding("cl100k_base")
+# Records per ChromaDB upsert, and records per page when reading the collection
+CHROMA_WRITE_BATCH = getattr(config, "CHROMA_WRITE_BATCH", 1000)
+CHROMA_READ_PAGE_SIZE = getattr(config, "CHROMA_READ_PAGE_SIZE", 1000)
+# The write buffer also flushes after this many documents, or once its oldest
+# record has waited this long, so a crash loses little finished work
+CHROMA_WRITE_MAX_DOCS = getattr(config, "CHROMA_WRITE_MAX_DOCS", 50)
+CHROMA_WRITE_MAX_SECONDS = getattr(config, "CHROMA_WRITE_MAX_SECONDS", 30.0)
 
-def chunk_text(text, max_tokens=6000, overlap=200):
+# Compact per-document vectors (mean of chunk embeddings) used for neighbour search
+DOC_VECTOR_PATH = getattr(config, "DOC_VECTOR_PATH", "./chroma_store/doc_vectors")
+DOC_VECTOR_DTYPE = getattr(config, "DOC_VECTOR_DTYPE", "float16")
+
+EMBED_CACHE_PATH = getattr(config, "EMBED_CACHE_PATH", "./chroma_store/embedding_cache.sqlite")
+EMBED_CACHE_MAX_ENTRIES = getattr(config, "EMBED_CACHE_MAX_ENTRIES", 50000)
+
+# ChromaDB and the embedding cache are opened on first use, so importing
+# this module (or running a command that never touches them) stays fast
+_collection = None
+_embedding_cache = None
+_document_store = None
+_init_lock = threading.Lock()
+
+def get_collection():
+    """Return the ChromaDB collection holding note embeddings, opening the store on first use."""
+    global _collection
+    if _collection is None:
+        with _init_lock:
+            if _collection is None:
+                import chromadb
+
+                client = chromadb.PersistentClient(path=CHROMA_PATH)
+                _collection = client.get_or_create_collection(name=COLLECTION_NAME)
+    return _collection
+
+def get_document_store():
+    """Return the memory-mapped store of document vectors, opening it on first use."""
+    global _document_store
+    if _document_store is None:
+        with _init_lock:
+            if _document_store is None:
+                _document_store = DocumentVectorStore(DOC_VECTOR_PATH, dtype=DOC_VECTOR_DTYPE)
+    return _document_store
+
+def get_embedding_cache():
+    """Return the persistent embedding cache shared by pass 1 (storage) and pass 2 (backlinks)."""
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _init_lock:
+            if _embedding_cache is None:
+                _embedding_cache = DiskCache(
+                    path=EMBED_CACHE_PATH,
+                    max_entries=EMBED_CACHE_MAX_ENTRIES,
+                    name="embedding"
+                )
+    return _embedding_cache
+
+def strip_embedded_images(md_content):
     """
-    Split text into chunks that fit within embedding model limits.
+    Remove base64 embedded images from markdown to reduce token count.
+    Keeps image placeholders for structure but removes base64 data.
     
     Args:
-        text: Full document text
-        max_tokens: Maximum tokens per chunk (default 6000, safe for 8k limit)
-        overlap: Token overlap between chunks for context continuity
+        md_content: Markdown text with embedded images
+        
+    Returns:
+        Cleaned markdown text without base64 image data
+    """
+    # Pattern to match: ![alt](data:image/...;base64,LONG_BASE64_STRING)
+    # Replace with: ![](image)
+    pattern = r'!\[[^\]]*\]\(data:image/[^;]+;base64,[A-Za-z0-9+/=]+\)'
+    cleaned = re.sub(pattern, '![](image)', md_content)
+    
+    return cleaned
+
+def embedding_cache_key(text, model=None):
+    """Cache key for an embedding: the model name plus a hash of the chunk text."""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{model or get_provider().embed_model}:{digest}"
+
+def pack_embedding_batches(texts, max_inputs=None, max_tokens=None, token_counts=None):
+    """
+    Group texts into request-sized batches.
+    
+    Args:
+        texts: List of texts to embed
+        max_inputs: Maximum number of inputs per request
+        max_tokens: Maximum total tokens per request
+        token_counts: Token count of each text, if already known
     
     Returns:
-        List of text chunks
+        List of batches, each a list of indices into texts
     """
-    tokens = tokenizer.encode(text)
-    chunks = []
-    
-    start = 0
-    while start < len(tokens):
-        end = start + max_tokens
-        chunk_tokens = tokens[start:end]
-        chunk_text = tokenizer.decode(chunk_tokens)
-        chunks.append(chunk_text)
-        
-        # Move start forward, accounting for overlap
-        start = end - overlap
+    max_inputs = max_inputs or EMBED_BATCH_MAX_INPUTS
+    max_tokens = max_tokens or EMBED_BATCH_MAX_TOKENS
+
+    batches = []
+    current = []
+    current_tokens = 0
+
+    for i, text in enumerate(texts):
+        n_tokens = token_counts[i] if token_counts is not None else len(get_tokenizer().encode(text))
+        if current and (len(current) >= max_inputs or current_tokens + n_tokens > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += n_tokens
+
+    if current:
+        batches.append(current)
+    return batches
+
+def generate_embeddings(texts, token_counts=None, use_cache=True):
+    """
+    Generate embeddings for many text chunks with as few API calls as possible.
+    Cached chunks are served from disk; the rest are deduplicated and packed
+    into multi-input requests.
     
-    return chunks
+    Args:
+        texts: List of text chunks
+        token_counts: Token count of each text, if already known
+        use_cache: Read and fill the on-disk embedding cache (False for
+                   one-off texts such as search queries, which would evict chunks)
+    
+    Returns:
+        List of embeddings in the same order as texts
+    """
+    embedding_cache = get_embedding_cache() if use_cache else None
+    model = get_provider().embed_model
+    keys = [embedding_cache_key(text, model) for text in texts]
+    cached = embedding_cache.get_many(keys) if use_cache else {}
 
-def generate_embedding(text):
-    """Generate embedding for a single text chunk."""
-    response = client.embeddings.create(
-        input=text,
-        model=EMBED_MODEL
-    )
-    return response.data[0].embedding
+    embeddings_by_key = {key: array("f", blob).tolist() for key, blob in cached.items()}
+
+    # Embed each missing text once, even if it appears several times
+    missing = {}
+    missing_counts = {}
+    for i, (key, text) in enumerate(zip(keys, texts)):
+        if key not in embeddings_by_key and key not in missing:
+            missing[key] = text
+            if token_counts is not None:
+                missing_counts[key] = token_counts[i]
 
-def store_in_chroma(doc_id, text, metadata):
+    missing_keys = list(missing)
+    missing_texts = list(missing.values())
+    missing_token_counts = [missing_counts[key] for key in missing_keys] if token_counts is not None else None
+
+    for batch in pack_embedding_batches(missing_texts, token_counts=missing_token_counts):
+        batch_tokens = sum(missing_token_counts[i] for i in batch) if missing_token_counts is not None else None
+        batch_embeddings = get_provider().embed([missing_texts[i] for i in batch], token_count=batch_tokens)
+        new_entries = {}
+        for i, embedding in zip(batch, batch_embeddings):
+            key = missing_keys[i]
+            embeddings_by_key[key] = embedding
+            new_entries[key] = array("f", embedding).tobytes()
+        if use_cache:
+            embedding_cache.set_many(new_entries)
+
+    return [embeddings_by_key[key] for key in keys]
+
+def embed_chunks(chunks, token_counts=None):
     """
-    Store document in ChromaDB with automatic chunking for long documents.
+    Embed a mapping of chunk ids to chunk text.
+    
+    Args:
+        chunks: Dictionary {chunk_id: text}
+        token_counts: Dictionary {chunk_id: token count}, if already known
+    
+    Returns:
+        Dictionary {chunk_id: embedding}
+    """
+    chunk_ids = list(chunks)
+    counts = [token_counts[chunk_id] for chunk_id in chunk_ids] if token_counts is not None else None
+    embeddings = generate_embeddings([chunks[chunk_id] for chunk_id in chunk_ids], token_counts=counts)
+    return dict(zip(chunk_ids, embeddings))
+
+def prepare_chunk_records(doc_id, text, metadata):
+    """
+    Split a document into the records stored in ChromaDB.
     
     Args:
         doc_id: Unique identifier for the document
         text: Full markdown text
         metadata: Document metadata (title, source, etc.)
+    
+    Returns:
+        List of (record_id, text, metadata, token_count) tuples
     """
-    # Check token count
-    token_count = len(tokenizer.encode(text))
+    # Image data never reaches the embedding model
+    text = strip_embedded_images(text)
+
+    # Encode once: the token ids give the size check, the chunk windows and their counts
+    tokenizer = get_tokenizer()
+    tokens = tokenizer.encode(text)
+    token_count = len(tokens)
     
-    if token_count > 6000:
-        # Chunk the document
-        chunks = chunk_text(text)
-        print(f"  └─ Document '{doc_id}' split into {len(chunks)} chunks ({token_count} tokens)")
-        
-        for i, chunk in enumerate(chunks):
-            chunk_id = f"{doc_id}_chunk_{i}"
-            embedding = generate_embedding(chunk)
-            
-            # Add chunk index to metadata
-            chunk_metadata = metadata.copy()
-            chunk_metadata["chunk_index"] = i
-            chunk_metadata["total_chunks"] = len(chunks)
-            chunk_metadata["parent_doc"] = doc_id
-            
-            collection.add(
-                ids=[chunk_id],
-                embeddings=[embedding],
-                metadatas=[chunk_metadata],
-                documents=[chunk]
-            )
-    else:
+    if token_count <= 6000:
         # Store as single document
-        embedding = generate_embedding(text)
-        collection.add(
-            ids=[doc_id],
-            embeddings=[embedding],
-            metadatas=[metadata],
-            documents=[text]
+        return [(doc_id, text, metadata, token_count)]
+
+    # Chunk the document
+    windows = split_tokens(tokens, max_tokens=6000, overlap=200)
+    print(f"  └─ Document '{doc_id}' split into {len(windows)} chunks ({token_count} tokens)")
+
+    records = []
+    for i, window in enumerate(windows):
+        # Add chunk index to metadata
+        chunk_metadata = metadata.copy()
+        chunk_metadata["chunk_index"] = i
+        chunk_metadata["total_chunks"] = len(windows)
+        chunk_metadata["parent_doc"] = doc_id
+        records.append((f"{doc_id}_chunk_{i}", tokenizer.decode(window), chunk_metadata, len(window)))
+    return records
+
+def embed_documents(documents):
+    """
+    Chunk and embed several documents, packing all their chunks into shared requests.
+    
+    Args:
+        documents: List of dictionaries with doc_id, text and metadata keys
+    
+    Returns:
+        (records, record_ids): records is a list of (record_id, text, metadata, embedding)
+        tuples ready for upsert_records, record_ids is {doc_id: [record ids]}
+    """
+    records = []
+    record_ids = {}
+    for doc in documents:
+        doc_records = prepare_chunk_records(doc["doc_id"], doc["text"], doc["metadata"])
+        record_ids[doc["doc_id"]] = [record[0] for record in doc_records]
+        records.extend(doc_records)
+
+    if not records:
+        return [], record_ids
+
+    embeddings = embed_chunks(
+        {record_id: chunk for record_id, chunk, _, _ in records},
+        token_counts={record_id: n_tokens for record_id, _, _, n_tokens in records}
+    )
+    return [
+        (record_id, chunk, chunk_metadata, embeddings[record_id])
+        for record_id, chunk, chunk_metadata, _ in records
+    ], record_ids
+
+def upsert_records(records):
+    """
+    Write embedded records (see embed_documents) to ChromaDB, CHROMA_WRITE_BATCH per call.
+    Existing records with the same ids are overwritten. Each document's
+    vector (the mean of its chunk embeddings) is updated in the document
+    store, so records must include all chunks of the documents they touch.
+    """
+    for start in range(0, len(records), CHROMA_WRITE_BATCH):
+        batch = records[start:start + CHROMA_WRITE_BATCH]
+        with metrics.timer("chroma_write_seconds", op="upsert"):
+            get_collection().upsert(
+                ids=[record_id for record_id, _, _, _ in batch],
+                embeddings=[embedding for _, _, _, embedding in batch],
+                metadatas=[chunk_metadata for _, _, chunk_metadata, _ in batch],
+                documents=[chunk for _, chunk, _, _ in batch]
+            )
+        metrics.inc("chroma_records_total", len(batch), op="upsert")
+
+    chunks_by_doc = {}
+    for _, _, chunk_metadata, embedding in records:
+        chunks_by_doc.setdefault(record_parent(chunk_metadata), []).append(embedding)
+    if chunks_by_doc:
+        get_document_store().upsert(
+            list(chunks_by_doc),
+            [np.mean(np.asarray(embeddings, dtype=np.float32), axis=0) for embeddings in chunks_by_doc.values()]
         )
 
+class ChromaWriteBuffer:
+    """
+    Write-behind buffer for embedded records.
+    Records are collected until batch_size records or max_groups add()
+    groups are buffered, or the oldest has waited max_seconds (checked on
+    add), and then written in one upsert, so storing many small documents
+    doesn't cost one ChromaDB transaction each while finished documents
+    still reach the store (and the manifest) regularly. If a combined write
+    fails, each add() group is retried on its own so one bad document
+    doesn't lose the others.
+
+    Args:
+        batch_size: Records buffered before a flush (default CHROMA_WRITE_BATCH)
+        max_groups: Groups (documents) buffered before a flush (default CHROMA_WRITE_MAX_DOCS)
+        max_seconds: Age of the oldest buffered group that triggers a flush (default CHROMA_WRITE_MAX_SECONDS)
+    """
+
+    def __init__(self, batch_size=None, max_groups=None, max_seconds=None):
+        self.batch_size = batch_size or CHROMA_WRITE_BATCH
+        self.max_groups = max_groups or CHROMA_WRITE_MAX_DOCS
+        self.max_seconds = max_seconds if max_seconds is not None else CHROMA_WRITE_MAX_SECONDS
+        self.groups = []
+        self.size = 0
+        self.oldest = None
+
+    def __len__(self):
+        return self.size
+
+    def add(self, records, item=None):
+        """
+        Buffer records, flushing when the buffer is full or has waited too long.
+        item identifies the group (e.g. its document) in flush results.
+
+        Returns:
+            flush() results if this call flushed, otherwise ([], [])
+        """
+        if not self.groups:
+            self.oldest = time.monotonic()
+        self.groups.append((records, item))
+        self.size += len(records)
+        if self.size >= self.batch_size or len(self.groups) >= self.max_groups \
+                or time.monotonic() - self.oldest >= self.max_seconds:
+            return self.flush()
+        return [], []
+
+    def flush(self):
+        """
+        Write all buffered records.
+
+        Returns:
+            (items written, [(item, exception)] for groups that failed)
+        """
+        groups, self.groups, self.size = self.groups, [], 0
+        if not groups:
+            return [], []
+
+        try:
+            upsert_records([record for records, _ in groups for record in records])
+            return [item for _, item in groups], []
+        except Exception as e:
+            print(f"\n    ⚠️  Batch write failed ({str(e)}), writing documents individually")
+
+        written, failed = [], []
+        for records, item in groups:
+            try:
+                upsert_records(records)
+                written.append(item)
+            except Exception as e:
+                failed.append((item, e))
+        return written, failed
+
+def store_documents_in_chroma(documents):
+    """
+    Store several documents in ChromaDB, embedding all their chunks in packed batches.
+    Existing records with the same ids are overwritten (upsert).
+    
+    Args:
+        documents: List of dictionaries with doc_id, text and metadata keys
+    
+    Returns:
+        Dictionary {doc_id: [record ids written]}
+    """
+    records, record_ids = embed_documents(documents)
+    upsert_records(records)
+    return record_ids
+
+def delete_records(record_ids):
+    """Delete records (documents or chunks) from ChromaDB by id, CHROMA_WRITE_BATCH per call."""
+    record_ids = list(record_ids)
+    for start in range(0, len(record_ids), CHROMA_WRITE_BATCH):
+        batch = record_ids[start:start + CHROMA_WRITE_BATCH]
+        with metrics.timer("chroma_write_seconds", op="delete"):
+            get_collection().delete(ids=batch)
+        metrics.inc("chroma_records_total", len(batch), op="delete")
+
+def iter_collection(include=("metadatas",), page_size=None):
+    """
+    Read the whole collection one page at a time, fetching only the fields in include.
+    Ids are always returned.
+    
+    Args:
+        include: Fields to fetch ("metadatas", "embeddings", "documents")
+        page_size: Records per request (default CHROMA_READ_PAGE_SIZE)
+    
+    Yields:
+        Result dictionaries from collection.get(), one per page
+    """
+    page_size = page_size or CHROMA_READ_PAGE_SIZE
+    collection = get_collection()
+    offset = 0
+    while True:
+        with metrics.timer("chroma_read_seconds"):
+            page = collection.get(include=list(include), limit=page_size, offset=offset)
+        if not page["ids"]:
+            return
+        yield page
+        if len(page["ids"]) < page_size:
+            return
+        offset += page_size
+
+def record_parent(metadata):
+    """Title of the document a record belongs to (chunks carry parent_doc, whole documents their title)."""
+    return metadata["parent_doc"] if "parent_doc" in metadata else metadata["title"]
+
 def get_all_documents():
     """
     Retrieve all unique document titles from ChromaDB.
     Returns set of parent document IDs (not chunk IDs).
+    Only metadata is read, one page at a time.
     """
-    all_data = collection.get()
     doc_ids = set()
-    
-    for metadata in all_data['metadatas']:
-        # Check if this is a chunk or a full document
-        if 'parent_doc' in metadata:
-            doc_ids.add(metadata['parent_doc'])
-        else:
-            doc_ids.add(metadata['title'])
-    
+    for page in iter_collection(include=["metadatas"]):
+        doc_ids.update(record_parent(metadata) for metadata in page["metadatas"])
     return doc_ids
@@ -0,0 +1,48 @@
+import atexit
+import config
+import threading
+
+# Connection pool shared by every API request (chat and embeddings). Keep
+# HTTP_MAX_CONNECTIONS at or above CHAT_MAX_CONCURRENCY plus the embedding
+# requests that run alongside, or requests queue for a free connection.
+HTTP_MAX_CONNECTIONS = getattr(config, "HTTP_MAX_CONNECTIONS", 20)
+HTTP_MAX_KEEPALIVE_CONNECTIONS = getattr(config, "HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+HTTP_KEEPALIVE_EXPIRY = getattr(config, "HTTP_KEEPALIVE_EXPIRY", 60.0)
+
+# Seconds; chat completions for large chunks can take a while to read
+HTTP_CONNECT_TIMEOUT = getattr(config, "HTTP_CONNECT_TIMEOUT", 10.0)
+HTTP_READ_TIMEOUT = getattr(config, "HTTP_READ_TIMEOUT", 300.0)
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+def get_http_client():
+    """
+    Return the process-wide pooled HTTP client, creating it on first use.
+    Connections are kept alive between requests, so concurrent and
+    back-to-back API calls reuse them instead of repeating TLS handshakes.
+    """
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                import httpx
+
+                _http_client = httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+                    ),
+                    timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+                )
+                atexit.register(close_http_client)
+    return _http_client
+
+def close_http_client():
+    """Close the shared client and its pooled connections."""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
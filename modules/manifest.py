@@ -0,0 +1,87 @@
+from modules.metrics import metrics
+import config
+import hashlib
+import json
+import os
+
+# Build manifest: what was generated from each source file on previous runs
+MANIFEST_PATH = getattr(config, "MANIFEST_PATH", "./chroma_store/manifest.json")
+
+def file_sha256(path):
+    """Hash a file's contents without loading it all into memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def text_sha256(text):
+    """Hash a string (UTF-8)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def load_manifest(path=MANIFEST_PATH):
+    """
+    Load the build manifest.
+
+    Returns:
+        Dictionary {source_file: {"title", "source_hash", "markdown_hash", "chunk_ids", "duplicate_of", "settings"}}
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    """Write the manifest atomically so a crash never leaves a truncated file."""
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+
+    tmp_path = f"{path}.tmp"
+    data = json.dumps(manifest, indent=2, sort_keys=True)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    metrics.inc("bytes_written_total", len(data.encode("utf-8")), kind="manifest")
+
+def record_document(manifest, source_file, title, source_hash, markdown_hash, chunk_ids, duplicate_of=None,
+                    settings=None):
+    """
+    Record what was generated for a source file, and the fingerprint of the
+    settings it was generated with. Near-duplicates record the title of the
+    note their content was reused from, and no chunks.
+
+    Returns:
+        Chunk ids written by the previous build that are no longer produced
+    """
+    previous = manifest.get(source_file, {})
+    stale_ids = sorted(set(previous.get("chunk_ids", [])) - set(chunk_ids))
+
+    manifest[source_file] = {
+        "title": title,
+        "source_hash": source_hash,
+        "markdown_hash": markdown_hash,
+        "chunk_ids": list(chunk_ids),
+        "duplicate_of": duplicate_of,
+        "settings": settings,
+    }
+    return stale_ids
+
+def is_unchanged(manifest, source_file, source_hash, markdown_body, settings=None):
+    """
+    Check whether a source file can be skipped: neither it, its note nor the
+    settings it was converted with have changed.
+
+    Args:
+        manifest: Loaded manifest
+        source_file: File name inside the input folder
+        source_hash: Current hash of the source file
+        markdown_body: Current generated markdown (without the Related Notes
+                       section), or None if the markdown file is missing
+        settings: Fingerprint of the current settings (see settings_fingerprint in main.py)
+    """
+    entry = manifest.get(source_file)
+    if entry is None or markdown_body is None:
+        return False
+    return entry["source_hash"] == source_hash and entry["markdown_hash"] == text_sha256(markdown_body) \
+        and entry.get("settings") == settings
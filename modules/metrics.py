@@ -0,0 +1,190 @@
+import contextlib
+import json
+import math
+import os
+import pstats
+import threading
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "max": self.max,
+            "buckets": {("+Inf" if math.isinf(b) else str(b)): c for b, c in self.cumulative()},
+        }
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and histograms for a pipeline run.
+    Each metric is identified by a name and a set of labels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record one observation in a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Time the enclosed block into a histogram (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def drain(self):
+        """Remove and return all metrics, e.g. to send them from a worker process to merge()."""
+        with self._lock:
+            drained = (self.counters, self.histograms)
+            self.counters = {}
+            self.histograms = {}
+        return drained
+
+    def merge(self, drained):
+        """Add metrics returned by drain() (in another process) to this registry."""
+        counters, histograms = drained
+        with self._lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, other in histograms.items():
+                histogram = self.histograms.setdefault(key, Histogram(other.buckets))
+                histogram.counts = [a + b for a, b in zip(histogram.counts, other.counts)]
+                histogram.count += other.count
+                histogram.sum += other.sum
+                histogram.max = max(histogram.max, other.max)
+
+    def snapshot(self):
+        """Return all metrics as plain data."""
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **histogram.to_dict()}
+                    for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0])
+                ],
+            }
+
+    def write_json(self, path, run_info=None):
+        """Write a JSON run report: run_info plus every metric."""
+        report = {"run": run_info or {}, "metrics": self.snapshot()}
+        write_text(path, json.dumps(report, indent=2))
+
+    def write_prometheus(self, path):
+        """Write all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                lines.append(f"{name}{format_labels(labels)} {value}")
+
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                for bound, count in histogram.cumulative():
+                    le = "+Inf" if math.isinf(bound) else str(bound)
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+        write_text(path, "\n".join(lines) + "\n")
+
+@contextlib.contextmanager
+def profiling(profiler):
+    """
+    Collect cProfile stats for the enclosed block into profiler (calling thread only).
+    One profiler can be enabled in turn from several threads, e.g. the
+    pipeline stages that handle the same document. Does nothing if profiler is None.
+    """
+    if profiler is None:
+        yield
+        return
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+def save_profile(profiler, path, top=25):
+    """Save profiler stats to path (open with pstats or snakeviz) and print the top functions by cumulative time."""
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    profiler.dump_stats(path)
+    print(f"\n Profile saved to {path}")
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = [
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in labels
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+def write_text(path, text):
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+# Process-wide registry used by all modules
+metrics = MetricsRegistry()
@@ -1,22 +1,84 @@
-from openai import AzureOpenAI
-from config import *
+from concurrent.futures import ThreadPoolExecutor
+from modules.chunking import chunk_by_tokens
+from modules.disk_cache import DiskCache
+from modules.metrics import metrics
+from modules.providers import get_provider
+from modules.rate_limiter import RetriesExhausted
+import config
+import hashlib
+import json
 import os
+import threading
 import textwrap
 import re
 
-client = AzureOpenAI(
-    api_key=AZURE_OPENAI_API_KEY,
-    api_version=AZURE_OPENAI_API_VERSION,
-    azure_endpoint=AZURE_OPENAI_ENDPOINT
-)
+# Parallel chat requests per document, and across all documents converting at once
+CHAT_DOC_CONCURRENCY = getattr(config, "CHAT_DOC_CONCURRENCY", 4)
+CHAT_MAX_CONCURRENCY = getattr(config, "CHAT_MAX_CONCURRENCY", 8)
+
+_chat_slots = threading.BoundedSemaphore(CHAT_MAX_CONCURRENCY)
+
+# Token budget for the document text in each conversion request. The model
+# rewrites the chunk, so this also bounds the size of each response.
+CONVERT_CHUNK_TOKENS = getattr(config, "CONVERT_CHUNK_TOKENS", 3000)
+
+SYSTEM_PROMPT = "You are a markdown converter. Output ONLY markdown with no commentary or explanations."
+TEMPERATURE = 0.3  # Lower temperature for more consistent output
+CONVERT_PROMPT = """Convert this text to clean Obsidian-compatible Markdown using LYT principles.
+
+CRITICAL RULES:
+1. Output ONLY the markdown - no preambles like "here is the conversion" or "sure"
+2. DO NOT modify or remove <<<IMAGE_X>>> placeholders - keep them EXACTLY as they appear
+3. Structure content with ## and ### headings
+4. Use [[internal links]] for related concepts
+5. Keep bullet points and formatting
+6. Be concise and atomic
+
+Text to convert:
+{chunk}
+
+Remember: Output the markdown directly with NO conversational text."""
+
+# Persistent cache of chat responses, so resumed runs skip already-converted chunks
+LLM_CACHE_ENABLED = getattr(config, "LLM_CACHE_ENABLED", True)
+LLM_CACHE_PATH = getattr(config, "LLM_CACHE_PATH", "./chroma_store/llm_cache.sqlite")
+LLM_CACHE_MAX_ENTRIES = getattr(config, "LLM_CACHE_MAX_ENTRIES", 20000)
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    """Return the chat response cache, opening it on first use."""
+    global _llm_cache
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                _llm_cache = DiskCache(path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES, name="llm")
+    return _llm_cache
+
+def llm_cache_key(model, system_prompt, user_prompt, temperature):
+    """Cache key for a chat response: hash of everything that determines the request."""
+    payload = json.dumps([model, system_prompt, user_prompt, temperature], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def conversion_settings():
+    """Settings that shape the markdown produced for a document (changing them reconverts every note)."""
+    return {
+        "chat_model": get_provider().chat_model,
+        "system_prompt": SYSTEM_PROMPT,
+        "prompt": CONVERT_PROMPT,
+        "temperature": TEMPERATURE,
+        "chunk_tokens": CONVERT_CHUNK_TOKENS,
+    }
 
 def extract_images_from_text(text):
     """
     Extract embedded images from text and return text with placeholders.
+    Handles both inline base64 images and links into the attachments store.
     Returns: (text_without_images, image_list)
     """
     # Pattern to match embedded images
-    image_pattern = r'!\[Image\]\(data:image/[^)]+\)'
+    image_pattern = r'!\[Image\]\([^)]+\)'
     
     images = re.findall(image_pattern, text)
     
@@ -39,67 +101,103 @@ def reinsert_images(text, images):
     
     return result
 
-def chunk_text(text, chunk_size=10000, overlap=200):
-    """Split long text into overlapping chunks while preserving images."""
+def chunk_text(text, max_tokens=None):
+    """
+    Split long text into chunks on heading/paragraph/table boundaries while preserving images.
+    Chunks are sized by token count and do not overlap, so no text is sent
+    (or converted) twice.
+    """
     # Extract images first
     text_no_images, images = extract_images_from_text(text)
-    
-    chunks = []
-    start = 0
-    while start < len(text_no_images):
-        end = start + chunk_size
-        chunk = text_no_images[start:end]
-        chunks.append(chunk)
-        start = end - overlap
+
+    chunks = chunk_by_tokens(text_no_images, max_tokens or CONVERT_CHUNK_TOKENS)
     
     return chunks, images
 
-def convert_to_lyt_markdown(content, title):
-    """Convert long Word document content to LYT-style Markdown in chunks."""
-    chunks, images = chunk_text(content)
-    full_markdown_output = f"# {title}\n\n"
+def convert_chunk(chunk, i, use_cache=None):
+    """
+    Convert a single chunk to markdown.
+    On error the original chunk text is returned so no content is lost,
+    except when the API stays throttled or unavailable past every retry:
+    then RetriesExhausted is raised, so the document fails and is converted
+    again on the next run instead of being saved unconverted.
+    
+    Args:
+        chunk: Text to convert
+        i: Chunk number (for log messages)
+        use_cache: Look up and store responses in the LLM cache (default LLM_CACHE_ENABLED)
+    """
+    prompt = CONVERT_PROMPT.format(chunk=chunk)
 
-    print(f"🧩 Splitting '{title}' into {len(chunks)} chunks for processing...")
+    if use_cache is None:
+        use_cache = LLM_CACHE_ENABLED
+    provider = get_provider()
+    cache_key = llm_cache_key(provider.chat_model, SYSTEM_PROMPT, prompt, TEMPERATURE)
 
-    for i, chunk in enumerate(chunks, 1):
-        prompt = f"""Convert this text to clean Obsidian-compatible Markdown using LYT principles.
+    try:
+        cached = get_llm_cache().get(cache_key) if use_cache else None
+        if cached is not None:
+            content = cached.decode("utf-8")
+        else:
+            # Global cap on in-flight chat requests across all documents
+            with _chat_slots:
+                content = provider.chat(
+                    messages=[
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=TEMPERATURE
+                )
+            # Only successful responses are cached; failures are retried next run
+            if use_cache:
+                get_llm_cache().set(cache_key, content.encode("utf-8"))
 
-CRITICAL RULES:
-1. Output ONLY the markdown - no preambles like "here is the conversion" or "sure"
-2. DO NOT modify or remove <<<IMAGE_X>>> placeholders - keep them EXACTLY as they appear
-3. Structure content with ## and ### headings
-4. Use [[internal links]] for related concepts
-5. Keep bullet points and formatting
-6. Be concise and atomic
+        md_chunk = content.strip()
+        
+        # Remove any common AI preambles if they slip through
+        md_chunk = re.sub(r'^(Sure[,!]?|Here is|Here\'s).*?(\n|:)', '', md_chunk, flags=re.IGNORECASE)
+        md_chunk = re.sub(r'^```markdown\s*', '', md_chunk)
+        md_chunk = re.sub(r'\s*```\s*$', '', md_chunk)
+        
+        return md_chunk
 
-Text to convert:
-{chunk}
+    except RetriesExhausted:
+        raise
+    except Exception as e:
+        print(f"⚠️ Error in chunk {i}: {e}")
+        metrics.inc("chunks_degraded_total")
+        # On error, include the original chunk
+        return chunk
 
-Remember: Output the markdown directly with NO conversational text."""
+def convert_to_lyt_markdown(content, title, max_workers=None, use_cache=None):
+    """
+    Convert long Word document content to LYT-style Markdown in chunks.
+    Chunks are converted in parallel and reassembled in their original order.
+    
+    Args:
+        content: Extracted document text
+        title: Document title
+        max_workers: Parallel chunk requests for this document
+                     (default CHAT_DOC_CONCURRENCY, 1 = sequential)
+        use_cache: Reuse cached responses for identical requests (default LLM_CACHE_ENABLED)
+    """
+    chunks, images = chunk_text(content)
+    full_markdown_output = f"# {title}\n\n"
+
+    print(f"🧩 Splitting '{title}' into {len(chunks)} chunks for processing...")
+
+    max_workers = max_workers or CHAT_DOC_CONCURRENCY
+    if max_workers <= 1 or len(chunks) <= 1:
+        md_chunks = [convert_chunk(chunk, i, use_cache) for i, chunk in enumerate(chunks, 1)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            # map() yields results in submission order
+            md_chunks = list(executor.map(
+                convert_chunk, chunks, range(1, len(chunks) + 1), [use_cache] * len(chunks)
+            ))
 
-        try:
-            response = client.chat.completions.create(
-                model=CHAT_MODEL,
-                messages=[
-                    {"role": "system", "content": "You are a markdown converter. Output ONLY markdown with no commentary or explanations."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3  # Lower temperature for more consistent output
-            )
-            md_chunk = response.choices[0].message.content.strip()
-            
-            # Remove any common AI preambles if they slip through
-            md_chunk = re.sub(r'^(Sure[,!]?|Here is|Here\'s).*?(\n|:)', '', md_chunk, flags=re.IGNORECASE)
-            md_chunk = re.sub(r'^```markdown\s*', '', md_chunk)
-            md_chunk = re.sub(r'\s*```\s*$', '', md_chunk)
-            
-            full_markdown_output += md_chunk + "\n\n"
-
-        except Exception as e:
-            print(f"⚠️ Error in chunk {i}: {e}")
-            # On error, include the original chunk
-            full_markdown_output += chunk + "\n\n"
-            continue
+    for md_chunk in md_chunks:
+        full_markdown_output += md_chunk + "\n\n"
 
     # Reinsert all images at their original positions
     full_markdown_output = reinsert_images(full_markdown_output, images)
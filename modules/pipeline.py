@@ -0,0 +1,179 @@
+import contextlib
+import queue
+import threading
+import time
+from modules.metrics import metrics
+
+# End-of-stream marker passed down the queues
+_DONE = object()
+
+class Stage:
+    """
+    One step of a Pipeline, run by its own pool of threads.
+
+    Args:
+        name: Stage name (for error reports and metrics)
+        fn: Called with one item and returns the item for the next stage.
+            With batch_size > 1 it is called with a list of items and
+            returns a list of items instead. Returning None drops the item.
+        workers: Threads running fn concurrently
+        batch_size: Maximum items passed to fn at once
+        batch_wait: Seconds to wait for a batch to fill before running fn on what has arrived
+    """
+
+    def __init__(self, name, fn, workers=1, batch_size=1, batch_wait=0.5):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+
+class Pipeline:
+    """
+    Runs items through a chain of stages connected by bounded queues.
+    Every stage works concurrently with the others; when a stage falls
+    behind, the queue in front of it fills up and the stages upstream
+    block (backpressure), so memory use depends on queue_size and the
+    number of workers, not on how many items are fed in.
+
+    Args:
+        stages: List of Stage
+        queue_size: Capacity of each queue between stages
+        on_error: Called as on_error(stage_name, item, exception) when fn raises;
+                  the item is dropped. Defaults to printing the error.
+    """
+
+    def __init__(self, stages, queue_size=8, on_error=None):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.on_error = on_error or self._print_error
+
+    @staticmethod
+    def _print_error(stage_name, item, exc):
+        print(f"    ✗ ERROR in {stage_name}: {exc}")
+
+    def run(self, items, on_result=None):
+        """
+        Feed items through every stage and wait for the pipeline to drain.
+
+        Args:
+            items: Iterable of input items (consumed lazily)
+            on_result: Called with each item leaving the last stage, as it arrives
+
+        Returns:
+            List of items produced by the last stage, in completion order
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        # The last stage's output is drained by the calling thread
+        queues.append(queue.Queue())
+
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, args=(stage, queues[i], queues[i + 1], remaining, lock),
+                    name=f"pipeline-{stage.name}", daemon=True
+                ))
+        for thread in threads:
+            thread.start()
+
+        results = []
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            results.append(item)
+            if on_result is not None:
+                on_result(item)
+
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _feed(self, items, outbox):
+        try:
+            for item in items:
+                outbox.put(item)
+        finally:
+            outbox.put(_DONE)
+
+    def _take(self, stage, inbox):
+        """Wait for the next item (or batch). Returns (items, input_finished)."""
+        start = time.perf_counter()
+        item = inbox.get()
+        metrics.inc("pipeline_idle_seconds_total", time.perf_counter() - start, stage=stage.name)
+        if item is _DONE:
+            return [], True
+
+        batch = [item]
+        deadline = time.monotonic() + stage.batch_wait
+        while len(batch) < stage.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = inbox.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _DONE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _apply(self, stage, batch):
+        try:
+            if stage.batch_size > 1:
+                results = stage.fn(batch)
+            else:
+                results = [stage.fn(batch[0])]
+        except Exception as e:
+            for item in batch:
+                self.on_error(stage.name, item, e)
+            return []
+        metrics.inc("pipeline_items_total", len(batch), stage=stage.name)
+        return [result for result in results if result is not None]
+
+    def _work(self, stage, inbox, outbox, remaining, lock):
+        try:
+            while True:
+                batch, finished = self._take(stage, inbox)
+                for result in self._apply(stage, batch) if batch else ():
+                    start = time.perf_counter()
+                    outbox.put(result)
+                    metrics.inc("pipeline_blocked_seconds_total", time.perf_counter() - start, stage=stage.name)
+                if finished:
+                    # Put the marker back so the other workers of this stage stop too
+                    inbox.put(_DONE)
+                    return
+        finally:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                outbox.put(_DONE)
+
+class Sequencer:
+    """
+    Lets concurrent workers run one step in the order their items were fed,
+    e.g. so a decision that depends on earlier items doesn't depend on which
+    worker finished first. Items are numbered 0, 1, 2... as they are fed;
+    every number must take its turn exactly once, even when its item fails.
+    """
+
+    def __init__(self):
+        self.next_ticket = 0
+        self._turn_changed = threading.Condition()
+
+    @contextlib.contextmanager
+    def turn(self, ticket):
+        """Wait until every earlier ticket has had its turn, then run the with-block."""
+        with self._turn_changed:
+            self._turn_changed.wait_for(lambda: self.next_ticket == ticket)
+        try:
+            yield
+        finally:
+            with self._turn_changed:
+                self.next_ticket += 1
+                self._turn_changed.notify_all()
@@ -0,0 +1,190 @@
+from modules.chunking import get_tokenizer
+from modules.http_client import get_http_client
+from modules.metrics import metrics
+from modules.rate_limiter import get_rate_limiter
+import config
+import hashlib
+import math
+import re
+import threading
+import time
+
+# Which backend serves embeddings and chat: "azure" (default) or "local" (offline)
+LLM_PROVIDER = getattr(config, "LLM_PROVIDER", "azure")
+
+# Artificial per-request delay for the local backend, to stand in for API latency
+LOCAL_PROVIDER_LATENCY_MS = getattr(config, "LOCAL_PROVIDER_LATENCY_MS", 0)
+
+def record_usage(kind, tokens_in, tokens_out=0):
+    """Count one completed API request and its token usage in the run metrics."""
+    metrics.inc("api_requests_total", kind=kind, status="ok")
+    metrics.inc("api_tokens_total", tokens_in, kind=kind, direction="in")
+    if tokens_out:
+        metrics.inc("api_tokens_total", tokens_out, kind=kind, direction="out")
+
+def estimate_chat_tokens(messages):
+    """
+    Tokens a chat request will count against the TPM quota: the prompt plus
+    a few tokens of framing per message, plus a reply assumed to be as long
+    as the prompt (the conversion rewrites the text it is given).
+    """
+    tokenizer = get_tokenizer()
+    prompt_tokens = sum(len(tokenizer.encode(message["content"])) + 4 for message in messages)
+    return 2 * prompt_tokens
+
+class AzureProvider:
+    """Embeddings and chat through Azure OpenAI deployments."""
+
+    name = "azure"
+
+    def __init__(self):
+        from openai import AzureOpenAI
+
+        self.client = AzureOpenAI(
+            api_key=config.AZURE_OPENAI_API_KEY,
+            api_version=config.AZURE_OPENAI_API_VERSION,
+            azure_endpoint=config.AZURE_OPENAI_ENDPOINT,
+            http_client=get_http_client(),
+            # Retries are handled by the shared rate limiter, which knows about every thread
+            max_retries=0
+        )
+        self.embed_model = config.EMBED_MODEL
+        self.chat_model = config.CHAT_MODEL
+
+    def request(self, kind, create, tokens, **kwargs):
+        """
+        Make one API call within the deployment's rate limits (see rate_limiter),
+        retrying throttled and transient failures.
+
+        Args:
+            kind: "chat" or "embed"
+            create: Method performing the request
+            tokens: Estimated tokens the request will use
+        """
+        def attempt():
+            try:
+                with metrics.timer("api_request_seconds", kind=kind):
+                    return create(**kwargs)
+            except Exception:
+                metrics.inc("api_requests_total", kind=kind, status="error")
+                raise
+
+        return get_rate_limiter(kind).call(attempt, tokens, usage=lambda response: response.usage.total_tokens)
+
+    def embed(self, texts, token_count=None):
+        """
+        Embed a list of texts in one request; returns embeddings in input order.
+        token_count is the texts' total token count, if already known.
+        """
+        if token_count is None:
+            tokenizer = get_tokenizer()
+            token_count = sum(len(tokenizer.encode(text)) for text in texts)
+
+        response = self.request("embed", self.client.embeddings.create, token_count, input=texts, model=self.embed_model)
+        record_usage("embed", response.usage.prompt_tokens)
+        embeddings = [None] * len(texts)
+        for item in response.data:
+            embeddings[item.index] = item.embedding
+        return embeddings
+
+    def chat(self, messages, temperature):
+        """Run a chat completion and return the reply text."""
+        response = self.request(
+            "chat",
+            self.client.chat.completions.create,
+            estimate_chat_tokens(messages),
+            model=self.chat_model,
+            messages=messages,
+            temperature=temperature
+        )
+        record_usage("chat", response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content
+
+class LocalProvider:
+    """
+    Offline backend for bulk re-linking, testing and profiling.
+    Embeddings come from a hashing vectorizer over word unigrams and bigrams;
+    chat returns the text to convert with light cleanup instead of calling a model.
+
+    Args:
+        dim: Embedding dimension
+        latency_ms: Simulated delay per request (embedding batch or chat call)
+    """
+
+    name = "local"
+
+    def __init__(self, dim=1536, latency_ms=None):
+        self.dim = dim
+        self.latency = (LOCAL_PROVIDER_LATENCY_MS if latency_ms is None else latency_ms) / 1000.0
+        self.embed_model = f"local-hash-{dim}"
+        self.chat_model = "local-passthrough"
+
+    def embed_one(self, text):
+        words = re.findall(r"\w+", text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+        counts = {}
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            # A sign bit keeps colliding features from only ever adding up
+            sign = 1.0 if digest[4] & 1 else -1.0
+            counts[index] = counts.get(index, 0.0) + sign
+
+        vector = [0.0] * self.dim
+        for index, count in counts.items():
+            vector[index] = math.copysign(math.log1p(abs(count)), count)
+
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed(self, texts, token_count=None):
+        """Embed a list of texts; returns unit-length vectors in input order."""
+        with metrics.timer("api_request_seconds", kind="embed"):
+            if self.latency:
+                time.sleep(self.latency)
+            embeddings = [self.embed_one(text) for text in texts]
+        tokenizer = get_tokenizer()
+        record_usage("embed", sum(len(tokenizer.encode(text)) for text in texts))
+        return embeddings
+
+    def chat(self, messages, temperature):
+        """Return the text from the last user message, tidied, as the 'converted' markdown."""
+        with metrics.timer("api_request_seconds", kind="chat"):
+            if self.latency:
+                time.sleep(self.latency)
+            content = messages[-1]["content"]
+            # The conversion prompt wraps the chunk between these two markers
+            if "Text to convert:\n" in content:
+                content = content.split("Text to convert:\n", 1)[1]
+                content = content.rsplit("\n\nRemember:", 1)[0]
+
+            lines = [line.rstrip() for line in content.strip().split("\n")]
+            reply = re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+
+        tokenizer = get_tokenizer()
+        record_usage(
+            "chat",
+            sum(len(tokenizer.encode(message["content"])) for message in messages),
+            len(tokenizer.encode(reply))
+        )
+        return reply
+
+PROVIDERS = {
+    "azure": AzureProvider,
+    "local": LocalProvider,
+}
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def get_provider():
+    """Return the configured provider, creating it on first use."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                if LLM_PROVIDER not in PROVIDERS:
+                    raise ValueError(f"Unknown LLM_PROVIDER '{LLM_PROVIDER}' (expected one of: {', '.join(PROVIDERS)})")
+                _provider = PROVIDERS[LLM_PROVIDER]()
+    return _provider
@@ -0,0 +1,198 @@
+from email.utils import parsedate_to_datetime
+from modules.metrics import metrics
+import config
+import random
+import threading
+import time
+
+# Deployment quotas (requests and tokens per minute). None = not limited.
+CHAT_RPM = getattr(config, "CHAT_RPM", None)
+CHAT_TPM = getattr(config, "CHAT_TPM", None)
+EMBED_RPM = getattr(config, "EMBED_RPM", None)
+EMBED_TPM = getattr(config, "EMBED_TPM", None)
+
+# Retries for throttled (429) and transient (408/409/5xx, connection) failures
+API_MAX_RETRIES = getattr(config, "API_MAX_RETRIES", 6)
+API_BACKOFF_BASE = getattr(config, "API_BACKOFF_BASE", 1.0)
+API_BACKOFF_MAX = getattr(config, "API_BACKOFF_MAX", 60.0)
+
+class RetriesExhausted(Exception):
+    """A request still failed with a retryable error after every retry."""
+
+    def __init__(self, kind, attempts, error):
+        super().__init__(f"{kind} request failed after {attempts} attempts: {error}")
+        self.kind = kind
+        self.attempts = attempts
+        self.error = error
+
+class TokenBucket:
+    """
+    Continuously refilling budget of `per_minute` units.
+    Callers reserve units and are told how long to wait before using them,
+    so requests are queued in arrival order instead of racing for capacity.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now, rate_scale=1.0):
+        """Take amount (may go negative) and return the seconds until it is covered."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate * rate_scale)
+        self.updated = now
+        # A single request larger than the whole budget still has to be let through eventually
+        self.level -= min(amount, self.capacity)
+        return 0.0 if self.level >= 0 else -self.level / (self.rate * rate_scale)
+
+    def refund(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+class RateLimiter:
+    """
+    Keeps one kind of API call (chat or embeddings) under its requests-per-minute
+    and tokens-per-minute quotas, shared by every thread.
+
+    Calls reserve their estimated tokens up front and wait until both budgets
+    allow them. Throttled calls (429) pause every caller until Retry-After has
+    passed and slow the refill rate, which then recovers gradually; transient
+    failures are retried with jittered exponential backoff.
+
+    Args:
+        kind: "chat" or "embed" (for metrics and error messages)
+        rpm: Requests per minute, or None for no request limit
+        tpm: Tokens per minute, or None for no token limit
+        max_retries: Retries after the first attempt
+    """
+
+    def __init__(self, kind, rpm=None, tpm=None, max_retries=API_MAX_RETRIES):
+        self.kind = kind
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_retries = max_retries
+        self.rate_scale = 1.0
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        """Block until one request of `tokens` tokens fits the quotas."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self.paused_until - now)
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, now, self.rate_scale))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(tokens, now, self.rate_scale))
+        if wait > 0:
+            metrics.inc("rate_limit_wait_seconds_total", wait, kind=self.kind)
+            time.sleep(wait)
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """Correct the token budget once the real usage of a request is known."""
+        if self.tokens is None or actual_tokens is None:
+            return
+        with self._lock:
+            self.tokens.refund(estimated_tokens - actual_tokens)
+
+    def throttled(self, delay):
+        """Pause all callers for delay seconds and slow down after a 429."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.rate_scale = max(0.25, self.rate_scale * 0.75)
+
+    def succeeded(self):
+        if self.rate_scale < 1.0:
+            with self._lock:
+                self.rate_scale = min(1.0, self.rate_scale + 0.02)
+
+    def call(self, fn, tokens, usage=None):
+        """
+        Run fn() within the quotas, retrying retryable failures.
+
+        Args:
+            fn: Performs one API request and returns its result
+            tokens: Estimated tokens the request will consume
+            usage: Optional function(result) returning the tokens actually used
+
+        Raises:
+            RetriesExhausted: A retryable error persisted past max_retries
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                status = status_code(e)
+                if not is_retryable(e):
+                    raise
+                if attempt == self.max_retries:
+                    raise RetriesExhausted(self.kind, attempt + 1, e) from e
+
+                delay = retry_after(e)
+                if status == 429:
+                    if delay is None:
+                        delay = min(API_BACKOFF_MAX, API_BACKOFF_BASE * (2 ** attempt))
+                    self.throttled(delay)
+                    metrics.inc("api_throttled_total", kind=self.kind)
+                elif delay is None:
+                    delay = backoff_delay(attempt)
+                metrics.inc("api_retries_total", kind=self.kind)
+                # Jitter so throttled workers don't all retry at the same instant
+                time.sleep(delay + random.uniform(0, min(1.0, delay / 4 + 0.1)))
+                continue
+
+            self.succeeded()
+            if usage is not None:
+                self.settle(tokens, usage(result))
+            return result
+
+def status_code(error):
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+def is_retryable(error):
+    """Rate limits, timeouts, conflicts, server errors and dropped connections are worth retrying."""
+    status = status_code(error)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    # Connection errors and timeouts carry no HTTP status
+    return any(cls.__name__ in ("APIConnectionError", "APITimeoutError") for cls in type(error).__mro__) \
+        or isinstance(error, (ConnectionError, TimeoutError))
+
+def retry_after(error):
+    """Seconds the server asked us to wait (retry-after-ms / retry-after headers), or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(API_BACKOFF_MAX, API_BACKOFF_BASE * (2 ** attempt)))
+
+LIMITS = {
+    "chat": (CHAT_RPM, CHAT_TPM),
+    "embed": (EMBED_RPM, EMBED_TPM),
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(kind):
+    """Return the process-wide limiter for "chat" or "embed" calls."""
+    with _limiters_lock:
+        if kind not in _limiters:
+            rpm, tpm = LIMITS[kind]
+            _limiters[kind] = RateLimiter(kind, rpm=rpm, tpm=tpm)
+        return _limiters[kind]
@@ -0,0 +1,81 @@
+from modules.embedding_manager import iter_collection, record_parent, delete_records, get_document_store
+from modules.manifest import save_manifest
+import os
+
+def list_note_titles(output_dir):
+    """Titles of the markdown notes currently in output_dir."""
+    return {os.path.splitext(f)[0] for f in os.listdir(output_dir) if f.endswith(".md")}
+
+def find_orphan_records(live_titles, manifest):
+    """
+    Find ChromaDB records that no longer belong to the live corpus:
+    records of documents without a markdown note, and records of live
+    documents that their last build no longer produced (e.g. chunks left
+    over after a document shrank, or a whole-document record replaced by chunks).
+
+    Args:
+        live_titles: Set of note titles that exist
+        manifest: Loaded manifest
+
+    Returns:
+        (orphan record ids, number of records scanned)
+    """
+    expected_ids = {entry["title"]: set(entry["chunk_ids"]) for entry in manifest.values()}
+
+    orphans = []
+    scanned = 0
+    for page in iter_collection(include=["metadatas"]):
+        for record_id, metadata in zip(page["ids"], page["metadatas"]):
+            scanned += 1
+            title = record_parent(metadata)
+            if title not in live_titles:
+                orphans.append(record_id)
+            elif title in expected_ids and record_id not in expected_ids[title]:
+                orphans.append(record_id)
+    return orphans, scanned
+
+def reconcile(output_dir, input_dir, manifest, dry_run=False, dedup_index=None):
+    """
+    Bring the collection and manifest back in line with the notes in output_dir.
+    Orphaned records are deleted in bulk, and manifest entries for notes
+    that no longer exist are dropped, so the next run doesn't skip them.
+    Notes whose source document has disappeared are reported, not deleted.
+
+    Args:
+        output_dir: Markdown notes folder
+        input_dir: Source documents folder
+        manifest: Loaded manifest (modified and saved unless dry_run)
+        dry_run: Only report what would be removed
+        dedup_index: DedupIndex to drop deleted notes from (saved unless dry_run)
+
+    Returns:
+        Dictionary with records_scanned, orphan_records, manifest_entries_pruned
+        and notes_without_source
+    """
+    live_titles = list_note_titles(output_dir)
+    orphan_ids, scanned = find_orphan_records(live_titles, manifest)
+
+    pruned = sorted(source for source, entry in manifest.items() if entry["title"] not in live_titles)
+    without_source = sorted(
+        entry["title"] for source, entry in manifest.items()
+        if entry["title"] in live_titles and not os.path.exists(os.path.join(input_dir, source))
+    )
+
+    if not dry_run:
+        delete_records(orphan_ids)
+        store = get_document_store()
+        store.remove([doc_id for doc_id in list(store.ids) if doc_id not in live_titles])
+        for source in pruned:
+            del manifest[source]
+        if pruned:
+            save_manifest(manifest)
+        if dedup_index is not None:
+            dedup_index.prune(live_titles)
+            dedup_index.save()
+
+    return {
+        "records_scanned": scanned,
+        "orphan_records": len(orphan_ids),
+        "manifest_entries_pruned": len(pruned),
+        "notes_without_source": without_source,
+    }
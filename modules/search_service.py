@@ -0,0 +1,222 @@
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from modules.embedding_manager import iter_collection, record_parent, generate_embeddings
+from modules.metrics import metrics
+from modules.rate_limiter import RetriesExhausted, status_code
+import json
+import threading
+import time
+import numpy as np
+
+# Query embeddings kept in memory; repeated queries skip the embedding call entirely
+QUERY_CACHE_SIZE = 1024
+
+class SearchService:
+    """
+    Semantic search over the notes stored in ChromaDB, kept warm in memory.
+
+    Every chunk embedding is loaded once into a matrix grouped by parent
+    document, so a query costs one embedding lookup and one matrix product.
+    Chunk hits are aggregated to their parent document (best chunk wins).
+
+    Args:
+        query_cache_size: Number of query embeddings kept in the in-memory LRU cache
+    """
+
+    def __init__(self, query_cache_size=QUERY_CACHE_SIZE):
+        self.query_cache_size = query_cache_size
+        self._query_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """(Re)load chunk vectors and document metadata from ChromaDB."""
+        start = time.perf_counter()
+        chunks_by_doc = {}
+        sources = {}
+        for page in iter_collection(include=["embeddings", "metadatas"]):
+            for meta, embedding in zip(page["metadatas"], page["embeddings"]):
+                doc_title = record_parent(meta)
+                chunks_by_doc.setdefault(doc_title, []).append(np.asarray(embedding, dtype=np.float32))
+                sources.setdefault(doc_title, meta.get("source"))
+
+        titles = sorted(chunks_by_doc)
+        if titles:
+            # Chunks of one document are contiguous rows; doc_starts marks where each begins
+            chunk_vectors = np.stack([embedding for title in titles for embedding in chunks_by_doc[title]])
+            doc_starts = np.cumsum([0] + [len(chunks_by_doc[title]) for title in titles[:-1]])
+        else:
+            chunk_vectors = np.zeros((0, 0), dtype=np.float32)
+            doc_starts = np.zeros(0, dtype=np.int64)
+
+        with self._index_lock:
+            self.titles = titles
+            self.sources = sources
+            self.chunk_vectors = chunk_vectors
+            self.chunk_sq_norms = np.einsum("ij,ij->i", chunk_vectors, chunk_vectors)
+            self.doc_starts = doc_starts
+
+        print(f" Loaded {len(chunk_vectors)} chunks from {len(titles)} notes in {time.perf_counter() - start:.2f}s")
+
+    def embed_queries(self, queries):
+        """Embed queries, serving repeats from the in-memory LRU cache."""
+        embeddings = {}
+        with self._cache_lock:
+            for query in queries:
+                if query in self._query_cache:
+                    self._query_cache.move_to_end(query)
+                    embeddings[query] = self._query_cache[query]
+
+        missing = [query for query in dict.fromkeys(queries) if query not in embeddings]
+        metrics.inc("cache_requests_total", len(queries) - len(missing), cache="query", result="hit")
+        metrics.inc("cache_requests_total", len(missing), cache="query", result="miss")
+
+        if missing:
+            # One packed request for all new queries; they stay out of the disk
+            # cache, where they would evict chunk embeddings
+            new_embeddings = generate_embeddings(missing, use_cache=False)
+            with self._cache_lock:
+                for query, embedding in zip(missing, new_embeddings):
+                    vector = np.asarray(embedding, dtype=np.float32)
+                    embeddings[query] = vector
+                    self._query_cache[query] = vector
+                while len(self._query_cache) > self.query_cache_size:
+                    self._query_cache.popitem(last=False)
+
+        return np.stack([embeddings[query] for query in queries])
+
+    def search_many(self, queries, k=10, max_distance=None):
+        """
+        Answer several queries with one matrix product.
+
+        Args:
+            queries: List of query strings
+            k: Maximum notes returned per query
+            max_distance: Only return notes closer than this (squared L2, lower = more similar)
+
+        Returns:
+            One list per query of {"title", "source", "distance"} dicts, nearest first
+        """
+        if not queries:
+            return []
+
+        with metrics.timer("search_seconds", batch="multi" if len(queries) > 1 else "single"):
+            query_vectors = self.embed_queries(queries)
+
+            with self._index_lock:
+                titles, sources = self.titles, self.sources
+                chunk_vectors, chunk_sq_norms, doc_starts = self.chunk_vectors, self.chunk_sq_norms, self.doc_starts
+
+            if not titles:
+                return [[] for _ in queries]
+
+            distances = (
+                np.einsum("ij,ij->i", query_vectors, query_vectors)[:, None]
+                + chunk_sq_norms[None, :]
+                - 2.0 * (query_vectors @ chunk_vectors.T)
+            )
+            # Best chunk per document
+            doc_distances = np.minimum.reduceat(distances, doc_starts, axis=1)
+
+            k = max(1, min(k, len(titles)))
+            candidates = np.argpartition(doc_distances, k - 1, axis=1)[:, :k]
+
+            results = []
+            for row, row_candidates in zip(doc_distances, candidates):
+                hits = []
+                for j in row_candidates[np.argsort(row[row_candidates])]:
+                    distance = float(row[j])
+                    if max_distance is not None and distance >= max_distance:
+                        break
+                    hits.append({"title": titles[j], "source": sources.get(titles[j]), "distance": distance})
+                results.append(hits)
+
+        metrics.inc("search_queries_total", len(queries))
+        return results
+
+    def search(self, query, k=10, max_distance=None):
+        """Find the k notes nearest to a single query."""
+        return self.search_many([query], k=k, max_distance=max_distance)[0]
+
+def make_search_handler(service):
+    """
+    Build an HTTP handler class serving:
+        GET  /search?q=<query>&k=<n>&max_distance=<d>        → {"query", "results"}
+        POST /search {"queries": [...], "k", "max_distance"} → {"results": [[...], ...]}
+        POST /reload                                          → reload vectors from ChromaDB
+    """
+
+    class SearchHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_error_json(self, error):
+            """Answer a failed search: 502 when the embedding API failed, 500 otherwise."""
+            metrics.inc("search_errors_total", error=type(error).__name__)
+            status = 502 if isinstance(error, RetriesExhausted) or status_code(error) is not None else 500
+            self.send_json(status, {"error": f"{type(error).__name__}: {error}"})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/search":
+                return self.send_json(404, {"error": "not found"})
+
+            params = parse_qs(url.query)
+            query = params.get("q", [""])[0]
+            if not query:
+                return self.send_json(400, {"error": "missing q"})
+            try:
+                k = int(params.get("k", ["10"])[0])
+                max_distance = float(params["max_distance"][0]) if "max_distance" in params else None
+            except ValueError:
+                return self.send_json(400, {"error": "k and max_distance must be numbers"})
+            try:
+                results = service.search(query, k=k, max_distance=max_distance)
+            except Exception as e:
+                return self.send_error_json(e)
+            self.send_json(200, {"query": query, "results": results})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path == "/reload":
+                try:
+                    service.reload()
+                except Exception as e:
+                    return self.send_error_json(e)
+                return self.send_json(200, {"notes": len(service.titles)})
+            if url.path != "/search":
+                return self.send_json(404, {"error": "not found"})
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                queries = request["queries"]
+                k = int(request.get("k", 10))
+                max_distance = request.get("max_distance")
+                max_distance = float(max_distance) if max_distance is not None else None
+            except (ValueError, KeyError, TypeError):
+                return self.send_json(400, {"error": 'expected JSON body {"queries": [...], "k": 10}'})
+            if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+                return self.send_json(400, {"error": "queries must be a list of strings"})
+            try:
+                results = service.search_many(queries, k=k, max_distance=max_distance)
+            except Exception as e:
+                return self.send_error_json(e)
+            self.send_json(200, {"results": results})
+
+        def log_message(self, format, *args):
+            # Keep the console quiet; request timings are in the metrics
+            pass
+
+    return SearchHandler
+
+def make_search_server(service, host="127.0.0.1", port=8765):
+    """Create a threaded HTTP server for service (call serve_forever() to run it)."""
+    return ThreadingHTTPServer((host, port), make_search_handler(service))
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+
+DTYPES = ("float16", "int8")
+
+class DocumentVectorStore:
+    """
+    Compact, memory-mapped store of one embedding per document.
+
+    Vectors are kept on disk in a .npy file opened with np.memmap, either as
+    float16 or as int8 with one float32 scale per row. Reads dequantize one
+    block at a time, so searches never hold the whole matrix in RAM. Rows
+    are addressed through an id index (index.json); upserting a new id
+    appends a row, and the file grows by doubling its capacity.
+
+    Files in directory:
+        vectors.npy  (capacity x dim) float16 or int8
+        scales.npy   (capacity,) float32 row scales (int8 only)
+        index.json   {"dim", "dtype", "ids"}
+
+    Args:
+        directory: Folder holding the store (created on first write)
+        dtype: "float16" (default) or "int8", used when creating a new store
+    """
+
+    def __init__(self, directory, dtype="float16"):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown vector dtype '{dtype}' (expected one of: {', '.join(DTYPES)})")
+        self.directory = directory
+        self.dtype = dtype
+        self.dim = None
+        self.ids = []
+        self.positions = {}
+        self.vectors = None
+        self.scales = None
+        self._lock = threading.RLock()
+
+        index_path = os.path.join(directory, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            self.dim = index["dim"]
+            self.dtype = index["dtype"]
+            self.ids = index["ids"]
+            self.positions = {doc_id: row for row, doc_id in enumerate(self.ids)}
+            self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r+")
+            if self.dtype == "int8":
+                self.scales = np.load(os.path.join(directory, "scales.npy"), mmap_mode="r+")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.positions
+
+    @property
+    def capacity(self):
+        return 0 if self.vectors is None else self.vectors.shape[0]
+
+    def _quantize(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), None
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def _dequantize(self, start, stop):
+        block = np.asarray(self.vectors[start:stop], dtype=np.float32)
+        if self.dtype == "int8":
+            block *= self.scales[start:stop, None]
+        return block
+
+    def _reserve(self, n_rows):
+        """Make room for n_rows rows, doubling the files' capacity as needed."""
+        if n_rows <= self.capacity:
+            return
+        capacity = max(n_rows, 2 * self.capacity, 1024)
+        os.makedirs(self.directory, exist_ok=True)
+
+        vectors_path = os.path.join(self.directory, "vectors.npy")
+        storage_dtype = np.float16 if self.dtype == "float16" else np.int8
+        grown = np.lib.format.open_memmap(f"{vectors_path}.tmp", mode="w+", dtype=storage_dtype, shape=(capacity, self.dim))
+        if self.vectors is not None:
+            grown[:len(self.ids)] = self.vectors[:len(self.ids)]
+        grown.flush()
+        del grown
+        self.vectors = None
+        os.replace(f"{vectors_path}.tmp", vectors_path)
+        self.vectors = np.load(vectors_path, mmap_mode="r+")
+
+        if self.dtype == "int8":
+            scales_path = os.path.join(self.directory, "scales.npy")
+            grown = np.lib.format.open_memmap(f"{scales_path}.tmp", mode="w+", dtype=np.float32, shape=(capacity,))
+            if self.scales is not None:
+                grown[:len(self.ids)] = self.scales[:len(self.ids)]
+            grown.flush()
+            del grown
+            self.scales = None
+            os.replace(f"{scales_path}.tmp", scales_path)
+            self.scales = np.load(scales_path, mmap_mode="r+")
+
+    def _save_index(self):
+        index_path = os.path.join(self.directory, "index.json")
+        with open(f"{index_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype, "ids": self.ids}, f)
+        os.replace(f"{index_path}.tmp", index_path)
+
+    def upsert(self, doc_ids, vectors):
+        """Store vectors under doc_ids, overwriting existing rows and appending new ones."""
+        if not len(doc_ids):
+            return
+        with self._lock:
+            vectors = np.asarray(vectors, dtype=np.float32)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match the store ({self.dim})")
+
+            new_ids = [doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id not in self.positions]
+            self._reserve(len(self.ids) + len(new_ids))
+            for doc_id in new_ids:
+                self.positions[doc_id] = len(self.ids)
+                self.ids.append(doc_id)
+
+            rows = np.array([self.positions[doc_id] for doc_id in doc_ids])
+            quantized, scales = self._quantize(vectors)
+            self.vectors[rows] = quantized
+            if scales is not None:
+                self.scales[rows] = scales
+            self.vectors.flush()
+            if scales is not None:
+                self.scales.flush()
+            self._save_index()
+
+    def remove(self, doc_ids):
+        """Delete documents; the last rows are moved into the freed slots."""
+        with self._lock:
+            removed = False
+            for doc_id in doc_ids:
+                row = self.positions.pop(doc_id, None)
+                if row is None:
+                    continue
+                last = len(self.ids) - 1
+                if row != last:
+                    moved_id = self.ids[last]
+                    self.vectors[row] = self.vectors[last]
+                    if self.scales is not None:
+                        self.scales[row] = self.scales[last]
+                    self.ids[row] = moved_id
+                    self.positions[moved_id] = row
+                self.ids.pop()
+                removed = True
+            if removed:
+                self.vectors.flush()
+                if self.scales is not None:
+                    self.scales.flush()
+                self._save_index()
+
+    def get(self, doc_id):
+        """Return a document's vector as float32, or None if it isn't stored."""
+        row = self.positions.get(doc_id)
+        if row is None:
+            return None
+        return self._dequantize(row, row + 1)[0]
+
+    def iter_blocks(self, block_size=2048):
+        """Yield (first row, float32 block) over all stored rows."""
+        for start in range(0, len(self.ids), block_size):
+            yield start, self._dequantize(start, min(start + block_size, len(self.ids)))
+
+    def fingerprints(self, block_size=2048):
+        """Short hash of every stored row, {doc_id: hex}; it changes whenever a document's vector does."""
+        fingerprints = {}
+        for start in range(0, len(self.ids), block_size):
+            stop = min(start + block_size, len(self.ids))
+            rows = np.asarray(self.vectors[start:stop])
+            scales = np.asarray(self.scales[start:stop]) if self.scales is not None else None
+            for offset in range(stop - start):
+                digest = hashlib.blake2b(rows[offset].tobytes(), digest_size=8)
+                if scales is not None:
+                    digest.update(scales[offset].tobytes())
+                fingerprints[self.ids[start + offset]] = digest.hexdigest()
+        return fingerprints
+
+    def squared_norms(self, block_size=2048):
+        """Squared L2 norm of every row (one float per document)."""
+        if not self.ids:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate([np.einsum("ij,ij->i", block, block) for _, block in self.iter_blocks(block_size)])
+
+    def nearest(self, queries, top_k=10, threshold=None, exclude=None, block_size=2048, sq_norms=None):
+        """
+        Blocked top-k search over the store. Distances are squared L2, like
+        ChromaDB's default metric, so thresholds mean the same as in the backlinker.
+
+        Args:
+            queries: Matrix of query vectors
+            top_k: Maximum results per query
+            threshold: Only return documents closer than this
+            exclude: Per query, a row index to skip (e.g. the query document itself), or None
+            block_size: Stored rows compared per matrix product (bounds memory use)
+            sq_norms: Precomputed squared_norms(), when searching repeatedly
+
+        Returns:
+            One list per query of (doc_id, distance), nearest first
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        n_queries = len(queries)
+        k = min(top_k, len(self.ids) - (1 if exclude is not None else 0))
+        if k <= 0 or n_queries == 0:
+            return [[] for _ in range(n_queries)]
+
+        if sq_norms is None:
+            sq_norms = self.squared_norms(block_size)
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        query_rows = np.arange(n_queries)
+
+        best_dist = np.full((n_queries, k), np.inf, dtype=np.float32)
+        best_rows = np.full((n_queries, k), -1, dtype=np.int64)
+
+        for start, block in self.iter_blocks(block_size):
+            distances = query_norms[:, None] + sq_norms[None, start:start + len(block)] - 2.0 * (queries @ block.T)
+            if exclude is not None:
+                local = np.asarray(exclude) - start
+                inside = (local >= 0) & (local < len(block))
+                distances[query_rows[inside], local[inside]] = np.inf
+
+            # Merge this block's candidates with the running top-k
+            merged_dist = np.concatenate([best_dist, distances], axis=1)
+            merged_rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(block)), distances.shape)], axis=1)
+            keep = np.argpartition(merged_dist, k - 1, axis=1)[:, :k]
+            best_dist = np.take_along_axis(merged_dist, keep, axis=1)
+            best_rows = np.take_along_axis(merged_rows, keep, axis=1)
+
+        order = np.argsort(best_dist, axis=1)
+        results = []
+        for i in range(n_queries):
+            hits = []
+            for j in order[i]:
+                distance = best_dist[i, j]
+                if best_rows[i, j] < 0 or (threshold is not None and not distance < threshold):
+                    continue
+                hits.append((self.ids[best_rows[i, j]], float(distance)))
+            results.append(hits)
+        return results
+
+    def nearest_all(self, threshold=0.25, top_k=10, block_size=2048):
+        """
+        Find the top_k nearest documents for every stored document, a block of queries at a time.
+
+        Returns:
+            Dictionary {doc_id: [(linked doc_id, distance), nearest first]}
+        """
+        sq_norms = self.squared_norms(block_size)
+        neighbours = {}
+        for start, block in self.iter_blocks(block_size):
+            results = self.nearest(
+                block, top_k=top_k, threshold=threshold,
+                exclude=np.arange(start, start + len(block)), block_size=block_size, sq_norms=sq_norms
+            )
+            for offset, hits in enumerate(results):
+                neighbours[self.ids[start + offset]] = hits
+        return neighbours
@@ -0,0 +1,88 @@
+import argparse
+import sys
+import time
+from modules.search_service import SearchService, make_search_server
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Semantic search over the notes stored in ChromaDB.")
+    parser.add_argument("query", nargs="*", help="Search once for this query and exit (default: interactive prompt)")
+    parser.add_argument("-k", type=int, default=10, help="Notes returned per query. Default: 10")
+    parser.add_argument("--max-distance", type=float, help="Only show notes closer than this distance")
+    parser.add_argument("--serve", action="store_true", help="Run the HTTP endpoint instead of the prompt")
+    parser.add_argument("--host", default="127.0.0.1", help="Address for --serve. Default: 127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765, help="Port for --serve. Default: 8765")
+    return parser.parse_args()
+
+def print_results(results):
+    if not results:
+        print("   (no matching notes)")
+    for rank, hit in enumerate(results, 1):
+        print(f"   {rank:>2}. [[{hit['title']}]]  ({hit['distance']:.3f})")
+
+def print_error(error):
+    print(f"   ⚠️  Search failed: {type(error).__name__}: {error}")
+
+def repl(service, k, max_distance):
+    print("Type a query, ':reload' to pick up new notes, or ':quit' to exit.")
+    while True:
+        try:
+            query = input("\nsearch> ").strip()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            return
+        if not query:
+            continue
+        if query in (":quit", ":q"):
+            return
+        if query == ":reload":
+            try:
+                service.reload()
+            except Exception as e:
+                print_error(e)
+            continue
+
+        start = time.perf_counter()
+        try:
+            results = service.search(query, k=k, max_distance=max_distance)
+        except Exception as e:
+            # An API outage fails this query, not the session
+            print_error(e)
+            continue
+        print_results(results)
+        print(f"   {(time.perf_counter() - start) * 1000:.1f} ms")
+
+def main():
+    args = parse_args()
+    service = SearchService()
+
+    if args.serve:
+        server = make_search_server(service, args.host, args.port)
+        print(f" Serving search on http://{args.host}:{args.port}/search?q=...")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif args.query:
+        try:
+            print_results(service.search(" ".join(args.query), k=args.k, max_distance=args.max_distance))
+        except Exception as e:
+            print_error(e)
+            sys.exit(1)
+    elif sys.stdin.isatty():
+        repl(service, args.k, args.max_distance)
+    else:
+        # One query per line from a pipe, answered in a single batch
+        queries = [line.strip() for line in sys.stdin if line.strip()]
+        try:
+            batch = service.search_many(queries, k=args.k, max_distance=args.max_distance)
+        except Exception as e:
+            print_error(e)
+            sys.exit(1)
+        for query, results in zip(queries, batch):
+            print(f"\n{query}")
+            print_results(results)
+
+if __name__ == "__main__":
+    main()
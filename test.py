@@ -1,17 +1,7 @@
-from openai import AzureOpenAI
-from config import *
+from modules.providers import get_provider
 
-client = AzureOpenAI(
-    api_key=AZURE_OPENAI_API_KEY,
-    api_version=AZURE_OPENAI_API_VERSION,
-    azure_endpoint=AZURE_OPENAI_ENDPOINT
-)
-
-result = client.embeddings.create(
-    input="This is a test sentence.",
-    model=EMBED_MODEL
-)
-
-print(len(result.data[0].embedding))  # should print 1536 or 3072 depending on model
+provider = get_provider()
 
+result = provider.embed(["This is a test sentence."])
 
+print(f"{provider.name}: {len(result[0])}")  # should print 1536 or 3072 depending on model